@@ -0,0 +1,111 @@
+import collections
+import concurrent.futures
+import csv
+import math
+import os
+import time
+
+from csv_server import RenderCache
+
+
+BatchJob = collections.namedtuple('BatchJob', ['csvfile', 'templatefile', 'output'])
+BatchResult = collections.namedtuple('BatchResult', ['job', 'seconds', 'error'])
+
+MANIFEST_FIELDS = ('csv', 'template', 'output')
+
+
+def read_manifest(filename):
+    """Read the jobs of a batch from a CSV with csv, template and output
+    columns. Relative paths are taken relative to the manifest."""
+    base = os.path.dirname(os.path.abspath(filename))
+    with open(filename, newline='') as fp:
+        reader = csv.DictReader(fp)
+        missing = set(MANIFEST_FIELDS) - set(reader.fieldnames or ())
+        if missing:
+            raise ValueError('manifest is missing columns: {}'.format(', '.join(sorted(missing))))
+        jobs = [BatchJob(*(os.path.join(base, row[field]) for field in MANIFEST_FIELDS))
+                for row in reader]
+    # jobs sharing an output would overwrite, or on failure delete, each
+    # other's files
+    outputs = collections.Counter(os.path.normcase(os.path.abspath(job.output)) for job in jobs)
+    duplicates = [output for output, count in outputs.items() if count > 1]
+    if duplicates:
+        raise ValueError('outputs should be unique, but these repeat: {}'.format(', '.join(duplicates)))
+    return jobs
+
+
+# each worker process keeps its own models and compiled templates
+_cache = None
+
+def _init_worker():
+    global _cache
+    _cache = RenderCache()
+
+def render_job(job):
+    if _cache is None:
+        _init_worker()
+    start = time.perf_counter()
+    error = None
+    try:
+        template_path, templatefile = os.path.split(os.path.abspath(job.templatefile))
+        chunks = _cache.generate(job.csvfile, templatefile, template_path)
+        # render next to the output and only replace it once the render
+        # succeeded, so a failed job leaves the previous output alone
+        tmp = job.output + '.tmp'
+        try:
+            with open(tmp, 'w') as fp:
+                fp.writelines(chunks)
+            os.replace(tmp, job.output)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+    except Exception as e:
+        error = '{}: {}'.format(type(e).__name__, e)
+    return BatchResult(job, time.perf_counter() - start, error)
+
+def _render_chunk(jobs):
+    return [render_job(job) for job in jobs]
+
+
+def _chunk_jobs(jobs, workers):
+    # jobs sharing a CSV go to the same worker so it's only loaded once, but
+    # big groups are still split so that every worker has something to do
+    groups = collections.OrderedDict()
+    for job in jobs:
+        groups.setdefault(os.path.abspath(job.csvfile), []).append(job)
+    size = max(1, math.ceil(len(jobs) / (workers * 4)))
+    chunks = []
+    for group in groups.values():
+        chunks.extend(group[i:i+size] for i in range(0, len(group), size))
+    return chunks
+
+
+def run_batch(jobs, workers=None, progress=None):
+    """Render every job and return their BatchResults in the order of jobs.
+
+    A job that fails gets its error message in its result instead of
+    stopping the rest. progress, if given, is called with each result as it
+    finishes.
+    """
+    workers = workers or os.cpu_count() or 1
+    results = {}
+    def finish(result):
+        results[result.job] = result
+        if progress is not None:
+            progress(result)
+    if workers == 1:
+        for job in jobs:
+            finish(render_job(job))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(workers, initializer=_init_worker) as pool:
+            futures = {pool.submit(_render_chunk, chunk): chunk for chunk in _chunk_jobs(jobs, workers)}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    chunk_results = future.result()
+                except Exception as e:
+                    error = 'worker failed: {}: {}'.format(type(e).__name__, e)
+                    chunk_results = [BatchResult(job, 0.0, error) for job in futures[future]]
+                for result in chunk_results:
+                    finish(result)
+    return [results[job] for job in jobs]
@@ -0,0 +1,97 @@
+import os
+import tempfile
+import unittest
+
+from csv_batch import BatchJob
+from csv_batch import _chunk_jobs
+from csv_batch import read_manifest
+from csv_batch import run_batch
+
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dir = self.tmpdir.name
+        for name, score in [('a.csv', 1), ('b.csv', 2)]:
+            with open(os.path.join(self.dir, name), 'w') as f:
+                f.write('Name,Score\nBob,{}\n'.format(score))
+        with open(os.path.join(self.dir, 'hello.template'), 'w') as f:
+            f.write('{% for row in rows %}{{ row.Name }}={{ row.Score + 1 }}{% endfor %}')
+        with open(os.path.join(self.dir, 'broken.template'), 'w') as f:
+            f.write('{{ rows|nosuchfilter }}')
+        self.manifest = os.path.join(self.dir, 'manifest.csv')
+        with open(self.manifest, 'w') as f:
+            f.write('csv,template,output\n'
+                    'a.csv,hello.template,a.out\n'
+                    'b.csv,hello.template,b.out\n'
+                    'a.csv,broken.template,broken.out\n'
+                    'b.csv,hello.template,b2.out\n')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def read(self, name):
+        with open(self.path(name)) as f:
+            return f.read()
+
+    def test_read_manifest(self):
+        jobs = read_manifest(self.manifest)
+        self.assertEqual(jobs[0], BatchJob(self.path('a.csv'), self.path('hello.template'), self.path('a.out')))
+        self.assertEqual(len(jobs), 4)
+
+    def test_read_manifest_missing_columns(self):
+        with open(self.manifest, 'w') as f:
+            f.write('csv,output\na.csv,a.out\n')
+        with self.assertRaises(ValueError):
+            read_manifest(self.manifest)
+
+    def test_read_manifest_duplicate_outputs(self):
+        with open(self.manifest, 'w') as f:
+            f.write('csv,template,output\na.csv,hello.template,o.out\na.csv,broken.template,sub/../o.out\n')
+        with self.assertRaises(ValueError) as cm:
+            read_manifest(self.manifest)
+        self.assertIn('o.out', str(cm.exception))
+
+    def test_chunk_jobs(self):
+        jobs = read_manifest(self.manifest) * 4
+        chunks = _chunk_jobs(jobs, workers=1)
+        self.assertEqual(sorted(job for chunk in chunks for job in chunk), sorted(jobs))
+        for chunk in chunks:
+            self.assertEqual(len(set(job.csvfile for job in chunk)), 1)
+        self.assertEqual(len(chunks), 4)
+
+    def check_results(self, results):
+        jobs = read_manifest(self.manifest)
+        self.assertEqual([result.job for result in results], jobs)
+        self.assertEqual([result.error is None for result in results], [True, True, False, True])
+        self.assertEqual(self.read('a.out'), 'Bob=2')
+        self.assertEqual(self.read('b.out'), 'Bob=3')
+        self.assertEqual(self.read('b2.out'), 'Bob=3')
+        self.assertFalse(os.path.exists(self.path('broken.out')))
+
+    def test_run_batch_in_process(self):
+        self.check_results(run_batch(read_manifest(self.manifest), workers=1))
+
+    def test_failed_job_keeps_previous_output(self):
+        with open(self.path('broken.out'), 'w') as f:
+            f.write('previous')
+        jobs = [BatchJob(self.path('a.csv'), self.path('broken.template'), self.path('broken.out')),
+                BatchJob(self.path('missing.csv'), self.path('hello.template'), self.path('broken2.out'))]
+        results = run_batch(jobs, workers=1)
+        self.assertTrue(all(result.error is not None for result in results))
+        self.assertEqual(self.read('broken.out'), 'previous')
+        self.assertEqual(sorted(os.listdir(self.dir)),
+                         ['a.csv', 'b.csv', 'broken.out', 'broken.template', 'hello.template', 'manifest.csv'])
+
+    def test_run_batch_pool(self):
+        finished = []
+        self.check_results(run_batch(read_manifest(self.manifest), workers=2, progress=finished.append))
+        self.assertEqual(len(finished), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
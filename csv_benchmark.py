@@ -0,0 +1,275 @@
+import argparse
+import csv
+import datetime
+import json
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from jinja2 import DictLoader
+
+from csv_model import BACKENDS, CSVDictModel, ENGINES, cast_rows, infer_types, numpy, set_backend
+from csv_view import CSVJinjaView, sortedby
+
+
+COLUMN_TYPES = ('int', 'float', 'bool', 'date', 'str')
+
+QUOTING = {
+    'minimal': csv.QUOTE_MINIMAL,
+    'all': csv.QUOTE_ALL,
+    'nonnumeric': csv.QUOTE_NONNUMERIC,
+    'none': csv.QUOTE_NONE,
+}
+
+TEMPLATES = {
+    'file': '{% for row in rows %}\n{{ row[0] }}: {{ row[1] }} {{ row[2] }}\n{% endfor %}\n',
+    'row': '{{ row[0] }}: {{ row[1] }} {{ row[2] }}\n',
+}
+
+
+def _make_value(rng, col_type, quote_fraction):
+    if col_type == 'int':
+        return str(rng.randint(-10**6, 10**6))
+    if col_type == 'float':
+        return repr(rng.uniform(-1e6, 1e6))
+    if col_type == 'bool':
+        return rng.choice(['true', 'false', 'yes', 'no'])
+    if col_type == 'date':
+        day = datetime.date(2000, 1, 1) + datetime.timedelta(days=rng.randrange(10000))
+        return day.isoformat()
+    value = ''.join(rng.choice(string.ascii_letters) for _ in range(rng.randint(3, 12)))
+    if rng.random() < quote_fraction:
+        # values that force the writer to quote them
+        value = rng.choice(['{}, {}', '"{}" {}', '{}\n{}']).format(value, value[::-1])
+    return value
+
+
+def generate_csv(fp, rows=1000, cols=8, types=COLUMN_TYPES, cardinality=None,
+                 quote_fraction=0.0, quoting=csv.QUOTE_MINIMAL, seed=0):
+    """Write a synthetic CSV with a header row to fp.
+
+    Column i holds values of types[i % len(types)]. With a cardinality, each
+    column draws from that many distinct values. The output only depends on
+    the arguments, so a given seed always produces the same file.
+    """
+    rng = random.Random(seed)
+    col_types = [types[i % len(types)] for i in range(cols)]
+    pools = None
+    if cardinality is not None:
+        pools = [[_make_value(rng, t, quote_fraction) for _ in range(cardinality)] for t in col_types]
+    writer = csv.writer(fp, quoting=quoting)
+    writer.writerow('{}_{}'.format(t, i) for i, t in enumerate(col_types))
+    for _ in range(rows):
+        if pools is None:
+            writer.writerow(_make_value(rng, t, quote_fraction) for t in col_types)
+        else:
+            writer.writerow(rng.choice(pool) for pool in pools)
+
+
+class BenchmarkContext:
+    def __init__(self, csvfile):
+        self.csvfile = csvfile
+        with open(csvfile, newline='') as f:
+            reader = csv.reader(f)
+            self.fieldnames = next(reader)
+            self.raw_rows = list(reader)
+        self.model = CSVDictModel.from_file(csvfile)
+        self.view = CSVJinjaView(env_options={'loader': DictLoader(TEMPLATES)})
+        self.sortkey = self.fieldnames[0]
+
+
+def bench_parse(ctx):
+    with open(ctx.csvfile, newline='') as f:
+        list(csv.reader(f))
+
+def bench_infer(ctx):
+    infer_types(ctx.raw_rows, len(ctx.fieldnames))
+
+def bench_cast(ctx):
+    cast_rows(ctx.raw_rows, ctx.model.types)
+
+def bench_row_slice(ctx):
+    ctx.model.row_slice(1, len(ctx.model) - 1)
+
+def bench_col_slice(ctx):
+    ctx.model.col_slice(1, None)
+
+def bench_sort(ctx):
+    sortedby(ctx.model, ctx.sortkey)
+
+def bench_render_rows(ctx):
+    ctx.view.render_template_for_rows('row', ctx.model, 0)
+
+def bench_render_file(ctx):
+    ctx.view.render_jinja_template('file', ctx.model)
+
+def _bench_from_file(engine):
+    def bench(ctx):
+        CSVDictModel.from_file(ctx.csvfile, engine=engine)
+    return bench
+
+BENCHMARKS = {
+    'parse': bench_parse,
+    'infer': bench_infer,
+    'cast': bench_cast,
+    'row_slice': bench_row_slice,
+    'col_slice': bench_col_slice,
+    'sort': bench_sort,
+    'render_rows': bench_render_rows,
+    'render_file': bench_render_file,
+}
+for _engine in ENGINES:
+    if _engine != 'numpy' or numpy is not None:
+        BENCHMARKS['from_file_' + _engine] = _bench_from_file(_engine)
+
+
+def measure(func, ctx, repeat=5):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(ctx)
+        times.append(time.perf_counter() - start)
+    # tracing allocations slows everything down, so peak memory gets a run
+    # of its own
+    tracemalloc.start()
+    try:
+        func(ctx)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    best = min(times)
+    rows = len(ctx.model)
+    return {
+        'seconds': best,
+        'rows_per_second': rows / best if best else float('inf'),
+        'peak_bytes': peak,
+    }
+
+
+def run_benchmarks(csvfile, names=None, repeat=5):
+    ctx = BenchmarkContext(csvfile)
+    results = {}
+    for name in names or BENCHMARKS:
+        results[name] = measure(BENCHMARKS[name], ctx, repeat=repeat)
+    return results
+
+
+def compare(results, baseline, threshold=0.1):
+    """Return (name, ratio) pairs for benchmarks that are more than threshold
+    slower than baseline, where ratio is new time over old time."""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result['seconds'] / baseline[name]['seconds']
+        if ratio > 1 + threshold:
+            regressions.append((name, ratio))
+    return regressions
+
+
+def mismatched_options(options, baseline_options):
+    """Return the options that differ from the baseline's, which make its
+    timings incomparable."""
+    # the baseline went through JSON, so compare the options the same way
+    options = json.loads(json.dumps(options))
+    baseline_options = baseline_options or {}
+    return sorted(name for name in set(options) | set(baseline_options)
+                  if options.get(name) != baseline_options.get(name))
+
+
+def format_results(results, baseline=None):
+    lines = ['{:<20} {:>12} {:>14} {:>12} {:>9}'.format(
+        'benchmark', 'seconds', 'rows/s', 'peak KiB', 'change')]
+    for name, result in results.items():
+        change = ''
+        if baseline and name in baseline:
+            change = '{:+.1%}'.format(result['seconds'] / baseline[name]['seconds'] - 1)
+        lines.append('{:<20} {:>12.6f} {:>14,.0f} {:>12,.1f} {:>9}'.format(
+            name, result['seconds'], result['rows_per_second'], result['peak_bytes'] / 1024, change))
+    return '\n'.join(lines)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark parsing, casting and rendering of synthetic CSVs.')
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--cols', type=int, default=8)
+    parser.add_argument('--types', default=','.join(COLUMN_TYPES),
+                        help='comma separated column types to cycle through')
+    parser.add_argument('--cardinality', type=int, default=None,
+                        help='number of distinct values per column')
+    parser.add_argument('--quote-fraction', type=float, default=0.0,
+                        help='fraction of string values that need quoting')
+    parser.add_argument('--quoting', choices=sorted(QUOTING), default='minimal',
+                        help='how the CSV writer quotes values (default: minimal)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--backend', choices=BACKENDS, default='python',
+                        help='column backend of the models (default: python)')
+    parser.add_argument('--only', default=None,
+                        help='comma separated benchmarks to run (default: all)')
+    parser.add_argument('--generate', metavar='FILE', default=None,
+                        help='only write the synthetic CSV to FILE')
+    parser.add_argument('--save', metavar='FILE', default=None,
+                        help='save the results as a JSON baseline')
+    parser.add_argument('--compare', metavar='FILE', default=None,
+                        help='compare against a saved baseline')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='slowdown that counts as a regression (default: 0.1)')
+    args = parser.parse_args(argv)
+    if args.quoting == 'none' and args.quote_fraction:
+        parser.error('--quoting none cannot write values that need quoting; use --quote-fraction 0')
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    set_backend(args.backend)
+    gen_options = {
+        'rows': args.rows,
+        'cols': args.cols,
+        'types': tuple(args.types.split(',')),
+        'cardinality': args.cardinality,
+        'quote_fraction': args.quote_fraction,
+        'quoting': args.quoting,
+        'seed': args.seed,
+    }
+    csv_options = dict(gen_options, quoting=QUOTING[args.quoting])
+    # saved with the generator options since they change the timings too
+    run_options = dict(gen_options, backend=args.backend, numpy=numpy is not None)
+    if args.generate:
+        with open(args.generate, 'w', newline='') as f:
+            generate_csv(f, **csv_options)
+        return
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            saved = json.load(f)
+        mismatched = mismatched_options(run_options, saved.get('options'))
+        if mismatched:
+            sys.exit('csv_benchmark: {} was run with different {}; rerun with the same options to compare'.format(
+                args.compare, ', '.join(mismatched)))
+        baseline = saved['results']
+    names = args.only.split(',') if args.only else None
+    with tempfile.TemporaryDirectory() as tmpdir:
+        csvfile = os.path.join(tmpdir, 'bench.csv')
+        with open(csvfile, 'w', newline='') as f:
+            generate_csv(f, **csv_options)
+        results = run_benchmarks(csvfile, names, repeat=args.repeat)
+    print(format_results(results, baseline))
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'options': run_options, 'results': results}, f, indent=2)
+    if baseline:
+        regressions = compare(results, baseline, args.threshold)
+        for name, ratio in regressions:
+            print('regression: {} is {:.2f}x slower than the baseline'.format(name, ratio), file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
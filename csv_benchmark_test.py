@@ -0,0 +1,103 @@
+import csv
+from contextlib import redirect_stderr
+import io
+import os
+import tempfile
+import unittest
+
+from csv_benchmark import BENCHMARKS
+from csv_benchmark import compare
+from csv_benchmark import generate_csv
+from csv_benchmark import main
+from csv_benchmark import mismatched_options
+from csv_benchmark import run_benchmarks
+from csv_model import CSVDictModel
+from csv_model import cast_to_bool
+from csv_model import cast_to_date
+from csv_model import numpy
+
+
+def generate(**kwargs):
+    f = io.StringIO(newline='')
+    generate_csv(f, **kwargs)
+    return f.getvalue()
+
+
+class TestGenerateCSV(unittest.TestCase):
+
+    def test_deterministic(self):
+        self.assertEqual(generate(rows=50, seed=3), generate(rows=50, seed=3))
+        self.assertNotEqual(generate(rows=50, seed=3), generate(rows=50, seed=4))
+
+    def test_shape(self):
+        rows = list(csv.reader(io.StringIO(generate(rows=20, cols=7, quote_fraction=0.5))))
+        self.assertEqual(len(rows), 21)
+        for row in rows:
+            self.assertEqual(len(row), 7)
+
+    def test_cardinality(self):
+        rows = list(csv.reader(io.StringIO(generate(rows=200, cols=3, cardinality=4))))[1:]
+        for col in zip(*rows):
+            self.assertLessEqual(len(set(col)), 4)
+
+    def test_quoting(self):
+        rows = list(csv.reader(io.StringIO(generate(rows=5, cols=3, types=('int',), quoting=csv.QUOTE_ALL))))
+        self.assertEqual(len(rows), 6)
+        self.assertTrue(generate(rows=5, quoting=csv.QUOTE_ALL).startswith('"'))
+
+    def test_types(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            csvfile = os.path.join(tmpdir, 'bench.csv')
+            with open(csvfile, 'w', newline='') as f:
+                generate_csv(f, rows=30, cols=5, types=('int', 'float', 'bool', 'date', 'str'))
+            model = CSVDictModel.from_file(csvfile)
+        self.assertEqual(model.types, [int, float, cast_to_bool, cast_to_date, str])
+
+
+class TestRunBenchmarks(unittest.TestCase):
+
+    def test_run(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            csvfile = os.path.join(tmpdir, 'bench.csv')
+            with open(csvfile, 'w', newline='') as f:
+                generate_csv(f, rows=20)
+            results = run_benchmarks(csvfile, repeat=1)
+        self.assertEqual(set(results), set(BENCHMARKS))
+        for result in results.values():
+            self.assertGreater(result['rows_per_second'], 0)
+            self.assertGreaterEqual(result['peak_bytes'], 0)
+
+    def test_compare(self):
+        baseline = {'fast': {'seconds': 1.0}, 'slow': {'seconds': 1.0}}
+        results = {'fast': {'seconds': 1.05}, 'slow': {'seconds': 2.0}, 'new': {'seconds': 1.0}}
+        self.assertEqual(compare(results, baseline, threshold=0.1), [('slow', 2.0)])
+
+    def test_mismatched_options(self):
+        options = {'rows': 10, 'types': ('int', 'str'), 'quoting': 'minimal'}
+        saved = {'rows': 10, 'types': ['int', 'str'], 'quoting': 'minimal'}
+        self.assertEqual(mismatched_options(options, saved), [])
+        self.assertEqual(mismatched_options(options, dict(saved, rows=20, quoting='all')), ['quoting', 'rows'])
+        self.assertEqual(mismatched_options(options, None), ['quoting', 'rows', 'types'])
+
+    def test_compare_refuses_other_options(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            baseline = os.path.join(tmpdir, 'baseline.json')
+            argv = ['--rows', '10', '--repeat', '1', '--only', 'parse']
+            main(argv + ['--save', baseline])
+            main(argv + ['--compare', baseline, '--threshold', '1000'])
+            with self.assertRaises(SystemExit) as cm:
+                main(argv + ['--compare', baseline, '--quoting', 'all'])
+            self.assertIn('quoting', str(cm.exception.code))
+            if numpy is not None:
+                with self.assertRaises(SystemExit) as cm:
+                    main(argv + ['--compare', baseline, '--backend', 'numpy'])
+                self.assertIn('backend', str(cm.exception.code))
+
+    def test_unknown_backend(self):
+        with self.assertRaises(SystemExit) as cm, redirect_stderr(io.StringIO()):
+            main(['--backend', 'nump'])
+        self.assertEqual(cm.exception.code, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+import json
+import os
+import socket
+import stat
+import struct
+import tempfile
+
+
+# every frame on the wire is a one byte kind followed by a payload length
+FRAME_HEADER = struct.Struct('!cI')
+FRAME_DATA = b'd'
+FRAME_ERROR = b'e'
+FRAME_END = b'z'
+
+
+class RenderServerError(Exception):
+    pass
+
+
+# seconds to wait for the server to accept a connection or send the next
+# frame before giving up
+DEFAULT_TIMEOUT = 60.0
+
+
+def default_socket_path():
+    """Return the render server's socket, which lives in $XDG_RUNTIME_DIR or
+    else in a directory under the temp dir that only the user can enter."""
+    path = os.environ.get('JINJA_CSV_SOCKET')
+    if path:
+        return path
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return os.path.join(runtime_dir, 'jinja_csv.sock')
+    uid = os.getuid() if hasattr(os, 'getuid') else 0
+    return os.path.join(tempfile.gettempdir(), 'jinja_csv-{}'.format(uid), 'render.sock')
+
+
+def make_socket_dir(socket_path):
+    """Create the directory of socket_path readable only by the user, and
+    check that an existing one is owned by the user and private."""
+    directory = os.path.dirname(os.path.abspath(socket_path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    st = os.lstat(directory)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise RuntimeError('{} should be a directory that only you can access'.format(directory))
+
+
+def is_trusted_socket(socket_path):
+    """Return whether socket_path is a socket owned by the user in a directory
+    that nobody else can swap it out of."""
+    if not hasattr(os, 'getuid'):
+        return True
+    try:
+        st = os.lstat(socket_path)
+        dir_st = os.stat(os.path.dirname(os.path.abspath(socket_path)))
+    except OSError:
+        return False
+    if not stat.S_ISSOCK(st.st_mode) or st.st_uid != os.getuid():
+        return False
+    # in a directory others can write to, only the sticky bit stops them
+    # from replacing the socket
+    return dir_st.st_uid == os.getuid() or not dir_st.st_mode & 0o022 or bool(dir_st.st_mode & stat.S_ISVTX)
+
+
+# struct ucred: pid, uid, gid
+PEERCRED = struct.Struct('3i')
+
+
+def peer_uid(sock):
+    """Return the uid of the process at the other end of the UNIX socket
+    sock, or None where the platform can't tell."""
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return None
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, PEERCRED.size)
+    return PEERCRED.unpack(creds)[1]
+
+
+def write_frame(fp, kind, payload=b''):
+    fp.write(FRAME_HEADER.pack(kind, len(payload)) + payload)
+
+
+def read_frame(fp):
+    header = fp.read(FRAME_HEADER.size)
+    if len(header) < FRAME_HEADER.size:
+        raise RenderServerError('render server closed the connection unexpectedly')
+    kind, length = FRAME_HEADER.unpack(header)
+    payload = fp.read(length)
+    if len(payload) < length:
+        raise RenderServerError('render server closed the connection unexpectedly')
+    return kind, payload
+
+
+def connect(socket_path=None, timeout=DEFAULT_TIMEOUT):
+    """Connect to the render server, or return None if there is no server
+    that can be trusted to be the user's own."""
+    if not hasattr(socket, 'AF_UNIX'):
+        return None
+    socket_path = socket_path or default_socket_path()
+    if not is_trusted_socket(socket_path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(socket_path)
+        uid = peer_uid(sock)
+    except OSError:
+        sock.close()
+        return None
+    if uid is not None and uid != os.getuid():
+        sock.close()
+        return None
+    return sock
+
+
+def render_remote(csvfile, templatefile, out, template_path=None, socket_path=None,
+                  timeout=DEFAULT_TIMEOUT, **kwargs):
+    """Render through a running render server, streaming the output to the
+    binary file object out.
+
+    Returns False without writing anything if no server is listening, so the
+    caller can fall back to rendering in-process.
+    """
+    sock = connect(socket_path, timeout)
+    if sock is None:
+        return False
+    request = {
+        'csvfile': os.path.abspath(csvfile),
+        'template': templatefile,
+        'template_path': os.path.abspath(template_path or os.getcwd()),
+        'kwargs': kwargs,
+    }
+    with sock, sock.makefile('rwb') as fp:
+        try:
+            fp.write(json.dumps(request).encode('utf-8') + b'\n')
+            fp.flush()
+        except OSError:
+            # the server went away before it got the request
+            return False
+        while True:
+            try:
+                kind, payload = read_frame(fp)
+            except OSError as e:
+                raise RenderServerError('lost the render server: {}'.format(e))
+            if kind == FRAME_DATA:
+                out.write(payload)
+            elif kind == FRAME_END:
+                return True
+            elif kind == FRAME_ERROR:
+                raise RenderServerError(payload.decode('utf-8'))
+            else:
+                raise RenderServerError('unknown frame {!r} from render server'.format(kind))
@@ -1,9 +1,27 @@
+import bz2
+import collections
+import contextlib
 import csv
+import gzip
+import io
 import itertools
 import datetime
+import lzma
+import math
+import operator
+import re
+import sys
+import warnings
 
 import dateutil.parser
 
+from csv_stats import phase_timer
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 class CSVRow(object):
     def __init__(self, row):
         self.data = tuple(row)
@@ -116,12 +134,216 @@ class CSVColumn(object):
     def cast(self, filter_func):
         return CSVColumn(filter(filter_func, self.data), name=self.fieldname)
 
+    def sum(self):
+        return sum(self.data)
+
+    def mean(self):
+        if not self.data:
+            raise ValueError('mean of an empty column')
+        return self.sum() / len(self)
+
+    def min(self):
+        return min(self.data)
+
+    def max(self):
+        return max(self.data)
+
+    def indices_where(self, op, value):
+        compare = get_operator(op)
+        return [i for i, v in enumerate(self.data) if compare(v, value)]
+
+    def argsort(self):
+        return sorted(range(len(self.data)), key=self.data.__getitem__)
+
     def __str__(self):
         if self.fieldname:
             return '{}: {}'.format(self.fieldname, self.data)
         return str(self.data)
 
 
+# Python 3.12 made sum() of floats compensated, which NumPy has no match for
+SEQUENTIAL_FLOAT_SUM = sys.version_info < (3, 12)
+
+class ArrayColumn(CSVColumn):
+    """A numeric or boolean column that also holds its values in a NumPy array,
+    which aggregates, comparisons and sorting run on.
+
+    Results match CSVColumn's exactly; where NumPy can't guarantee that, the
+    Python implementation is used.
+    """
+
+    def __init__(self, col, array, name=None):
+        super().__init__(col, name=name)
+        self.array = array
+
+    def _fits_float64(self):
+        return not self.data or max(-int(self.array.min()), int(self.array.max())) <= 2**53
+
+    def _has_nan(self):
+        return self.array.dtype.kind == 'f' and bool(numpy.isnan(self.array).any())
+
+    def sum(self):
+        if not self.data:
+            return super().sum()
+        if self.array.dtype.kind == 'i':
+            largest = max(-int(self.array.min()), int(self.array.max()))
+            if largest * len(self) >= 2**63:
+                # the int64 sum could overflow
+                return super().sum()
+        if self.array.dtype.kind == 'f':
+            if not SEQUENTIAL_FLOAT_SUM:
+                return super().sum()
+            # NumPy's sum is pairwise, so add left to right like Python does.
+            # Python's sum starts from 0, which turns a total of -0.0 into 0.0.
+            return numpy.add.accumulate(self.array)[-1].item() + 0
+        return self.array.sum().item()
+
+    def min(self):
+        if not self.data or self._has_nan():
+            return super().min()
+        return self._python_zero(self.array.min().item(), super().min)
+
+    def max(self):
+        if not self.data or self._has_nan():
+            return super().max()
+        return self._python_zero(self.array.max().item(), super().max)
+
+    def _python_zero(self, result, fallback):
+        # 0.0 and -0.0 tie, and Python returns whichever comes first
+        if self.array.dtype.kind == 'f' and result == 0:
+            return fallback()
+        return result
+
+    def indices_where(self, op, value):
+        compare = get_operator(op)
+        if self.array.dtype.kind == 'i' and isinstance(value, float):
+            # NumPy compares int64 with float64 after rounding the ints past
+            # 2**53, while Python compares them exactly
+            if value.is_integer():
+                value = int(value)
+            elif not self._fits_float64():
+                return super().indices_where(op, value)
+        if not isinstance(value, (int, float)) or isinstance(value, int) and not -2**63 <= value < 2**63:
+            return super().indices_where(op, value)
+        return numpy.flatnonzero(compare(self.array, value)).tolist()
+
+    def argsort(self):
+        if self._has_nan():
+            # NaNs make Python's sort order depend on where they are
+            return super().argsort()
+        return numpy.argsort(self.array, kind='stable').tolist()
+
+
+OPERATORS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+def get_operator(op):
+    try:
+        return OPERATORS[op]
+    except KeyError:
+        raise ValueError('unknown comparison {!r}; expected one of {}'.format(op, ', '.join(OPERATORS)))
+
+AGGREGATES = ('sum', 'mean', 'min', 'max')
+
+def _check_aggregate(fn):
+    if fn not in AGGREGATES:
+        raise ValueError('unknown aggregate {!r}; expected one of {}'.format(fn, ', '.join(AGGREGATES)))
+
+def rolling_aggregate(values, window, fn='mean'):
+    """Aggregate each value with the window-1 values before it, in one pass.
+
+    The first window-1 results only cover the values seen so far.
+    """
+    _check_aggregate(fn)
+    if window < 1:
+        raise ValueError('window must be at least 1, not {}'.format(window))
+    values = list(values)
+    results = []
+    if fn in ('min', 'max'):
+        # indices of the values that can still become the window's min/max,
+        # whose values only ever increase (min) or decrease (max)
+        dominates = operator.le if fn == 'min' else operator.ge
+        candidates = collections.deque()
+        for i, value in enumerate(values):
+            while candidates and dominates(value, values[candidates[-1]]):
+                candidates.pop()
+            candidates.append(i)
+            if candidates[0] <= i - window:
+                candidates.popleft()
+            results.append(values[candidates[0]])
+        return results
+    total = _WindowSum()
+    for i, value in enumerate(values):
+        total.add(value)
+        if i >= window:
+            total.remove(values[i - window])
+        results.append(total.value() if fn == 'sum' else total.value() / min(i + 1, window))
+    return results
+
+class _WindowSum:
+    # An exact running sum that values can be taken out of again. Finite
+    # values are kept as non-overlapping partials, like math.fsum does, so
+    # removing one cancels exactly; infinities and NaNs are only counted.
+
+    def __init__(self):
+        self.partials = []
+        self.floats = 0
+        self.special = collections.Counter()
+
+    def _add(self, x):
+        i = 0
+        for y in self.partials:
+            if abs(x) < abs(y):
+                x, y = y, x
+            hi = x + y
+            lo = y - (hi - x)
+            if lo:
+                self.partials[i] = lo
+                i += 1
+            x = hi
+        self.partials[i:] = [x]
+
+    def add(self, value, sign=1):
+        if isinstance(value, float):
+            self.floats += sign
+            if not math.isfinite(value):
+                self.special[repr(value)] += sign
+                return
+        self._add(value if sign > 0 else -value)
+
+    def remove(self, value):
+        self.add(value, -1)
+
+    def value(self):
+        if self.special['nan'] or self.special['inf'] and self.special['-inf']:
+            return math.nan
+        if self.special['inf'] or self.special['-inf']:
+            return math.inf if self.special['inf'] else -math.inf
+        if self.floats:
+            return math.fsum(self.partials)
+        return sum(self.partials)
+
+def cumulative_aggregate(values, fn='sum'):
+    _check_aggregate(fn)
+    results = []
+    if fn in ('min', 'max'):
+        pick = min if fn == 'min' else max
+        for value in values:
+            results.append(pick(results[-1], value) if results else value)
+        return results
+    total = 0
+    for i, value in enumerate(values):
+        total += value
+        results.append(total if fn == 'sum' else total / (i + 1))
+    return results
+
+
 def cast_to_bool(s=None):
     if s is None:
         return False
@@ -146,41 +368,257 @@ def cast_to_date(d=None, parserinfo=None, **kwargs):
     raise ValueError()
 
 
-class CSVModel:
-    def __init__(self, rows, types=None):
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+
+# compressed files are recognized by their leading bytes rather than their
+# extension. The patterns cover the whole header, not just its first bytes,
+# so a plain CSV whose header happens to begin with 'BZh' isn't taken for bz2.
+COMPRESSION_MAGIC = (
+    # gzip magic and the deflate method byte
+    (re.compile(b'\x1f\x8b\x08'), lambda raw: gzip.GzipFile(fileobj=raw)),
+    # 'BZh', the block size, then the magic of the first block or, for an
+    # empty stream, of the end of stream
+    (re.compile(b'BZh[1-9](?:1AY&SY|\x17rE8P\x90)'), bz2.BZ2File),
+    (re.compile(b'\xfd7zXZ\x00'), lzma.LZMAFile),
+)
+MAGIC_SIZE = 10
+
+@contextlib.contextmanager
+def open_csv(filename, encoding=None, buffer_size=DEFAULT_BUFFER_SIZE):
+    # the file is only opened once and sniffed with peek, so pipes work too
+    with open(filename, 'rb', buffering=buffer_size) as raw:
+        magic = raw.peek(MAGIC_SIZE)
+        stream = raw
+        for pattern, decompressor in COMPRESSION_MAGIC:
+            if pattern.match(magic):
+                stream = io.BufferedReader(decompressor(raw), buffer_size)
+                break
+        # closing the wrapper doesn't close raw when a decompressor sits in
+        # between, which the outer with takes care of
+        with io.TextIOWrapper(stream, encoding=encoding, newline='') as csvfile:
+            yield csvfile
+
+
+DEFAULT_CASTS = (int, float, cast_to_bool, cast_to_date)
+
+def infer_type(values, casts=DEFAULT_CASTS):
+    # try to find the most specific cast
+    for cast in casts:
+        try:
+            list(map(cast, values))
+        except ValueError:
+            continue
+        return cast
+    return str
+
+def infer_types(rows, num_cols):
+    return [infer_type([row[i] for row in rows if i < len(row)]) for i in range(num_cols)]
+
+def cast_rows(rows, types):
+    return [[t(row[i]) if i < len(row) else t() for i, t in enumerate(types)] for row in rows]
+
+def _num_cols(rows, types):
+    num_cols = max(map(len, rows))
+    if types is not None and len(types) != num_cols:
+        raise ValueError(('number of given types ({}) should match '
+                          'number of columns ({})!').format(len(types), num_cols))
+    return num_cols
+
+
+# A parser engine takes an iterable of rows of strings, optional types and an
+# optional RenderStats and returns ParsedRows: the rows cast to their types,
+# the types that were used and, optionally, NumPy arrays of some columns keyed
+# by column index, which models keep as ArrayColumns.
+ParsedRows = collections.namedtuple('ParsedRows', ['rows', 'types', 'arrays'])
+ParsedRows.__new__.__defaults__ = (None,)
+
+def python_engine(rows, types=None, stats=None):
+    phase = phase_timer(stats)
+    with phase('parse'):
+        rows = tuple(rows)
+    num_cols = _num_cols(rows, types)
+    if types is None:
+        with phase('infer'):
+            types = infer_types(rows, num_cols)
+    with phase('cast'):
+        return ParsedRows(cast_rows(rows, types), types)
+
+NUMPY_DTYPES = {int: 'int64', float: 'float64'}
+
+# The only characters handed to NumPy's C parser. Anything else (whitespace,
+# underscores, inf, nan, non-ASCII digits) is left to Python, so both agree
+# on what a number is.
+NUMPY_CHARS = {
+    int: str.maketrans('', '', '0123456789+-\n'),
+    float: str.maketrans('', '', '0123456789+-.eE\n'),
+}
+
+def _join_column(col):
+    # a column is parsed as one string; a value with a newline in it would
+    # throw off the count, so such columns are left to Python
+    try:
+        joined = '\n'.join(col)
+    except TypeError:
+        return None
+    if joined.count('\n') != len(col) - 1:
+        return None
+    return joined
+
+def _numpy_parse_column(col, joined, cast):
+    if joined is None or joined.translate(NUMPY_CHARS[cast]):
+        return None
+    if cast is int and max(map(len, col)) > 18:
+        # longer integers might not fit in 64 bits
+        return None
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        try:
+            array = numpy.fromstring(joined, dtype=NUMPY_DTYPES[cast], sep='\n')
+        except ValueError:
+            return None
+    # the parser stops at the first malformed value, e.g. '1-2' or ''
+    if len(array) != len(col):
+        return None
+    return array
+
+def _numpy_cast_column(col, cast=None):
+    if cast is not None:
+        array = _numpy_parse_column(col, _join_column(col), cast) if cast in NUMPY_DTYPES else None
+        if array is None:
+            return [cast(v) for v in col], None
+        return array.tolist(), array
+    joined = _join_column(col)
+    array = _numpy_parse_column(col, joined, int)
+    if array is not None:
+        return int, array.tolist(), array
+    # Python also takes ints like ' 5' or '1_000'; this fails on the first
+    # value of most other columns
+    try:
+        return int, list(map(int, col)), None
+    except ValueError:
+        pass
+    array = _numpy_parse_column(col, joined, float)
+    if array is not None:
+        return float, array.tolist(), array
+    cast = infer_type(col, DEFAULT_CASTS[1:])
+    return cast, [cast(v) for v in col], None
+
+def numpy_engine(rows, types=None, stats=None):
+    if numpy is None:
+        raise ImportError('the numpy parser engine requires numpy')
+    phase = phase_timer(stats)
+    with phase('parse'):
         rows = tuple(rows)
-        max_len = max(map(len, rows))
+    num_cols = _num_cols(rows, types)
+    if any(len(row) != num_cols for row in rows):
+        # short rows are padded cell by cell, so leave them to Python
+        return python_engine(rows, types, stats)
+    with phase('cast'):
+        return _numpy_cast_rows(rows, types)
+
+def _numpy_cast_rows(rows, types):
+    # inference happens while casting, so it isn't timed separately
+    new_types = []
+    new_cols = []
+    arrays = {}
+    for i, col in enumerate(zip(*rows)):
         if types is None:
-            casts = [int, float, cast_to_bool, cast_to_date]
-            types = [str]*max_len
-            for i in range(max_len):
-                # try to find the most specific cast
-                for cast in casts:
-                    try:
-                        list(map(cast, (row[i] for row in rows if i < len(row))))
-                    except ValueError:
-                        continue
-                    types[i] = cast
-                    break
-        elif len(types) != max_len:
-            raise ValueError(('number of given types ({}) should match '
-                              'number of columns ({})!').format(len(types), max_len))
-
-        new_rows = []
-        for row in rows:
-            new_row = [t(row[i]) if i < len(row) else t() for i, t in enumerate(types)]
-            new_rows.append(self._init_row(new_row))
-        self._rows = tuple(new_rows)
-        self._cols = tuple(self._init_col(i) for i in range(max_len))
-        self.num_cols = max_len
-        self.num_rows = len(rows)
+            cast, values, array = _numpy_cast_column(col)
+            new_types.append(cast)
+        else:
+            values, array = _numpy_cast_column(col, types[i])
+        new_cols.append(values)
+        if array is not None:
+            arrays[i] = array
+    return ParsedRows(list(zip(*new_cols)), new_types if types is None else types, arrays)
+
+ENGINES = {
+    'python': python_engine,
+    'numpy': numpy_engine,
+}
+
+def get_engine(engine=None):
+    # without an engine, models are parsed the way the backend stores them
+    if engine is None:
+        engine = _backend
+    if callable(engine):
+        return engine
+    try:
+        return ENGINES[engine]
+    except KeyError:
+        raise ValueError('unknown parser engine {!r}; expected one of {}'.format(
+            engine, ', '.join(sorted(ENGINES))))
+
+# With the numpy backend models parse numeric columns in bulk and keep their
+# numeric and boolean columns as ArrayColumns.
+BACKENDS = ('python', 'numpy')
+_backend = 'python'
+
+def set_backend(backend):
+    global _backend
+    if backend not in BACKENDS:
+        raise ValueError('unknown backend {!r}; expected one of {}'.format(backend, ', '.join(BACKENDS)))
+    if backend == 'numpy' and numpy is None:
+        raise ImportError('the numpy backend requires numpy')
+    _backend = backend
+
+def get_backend():
+    return _backend
+
+NUMPY_COLUMN_DTYPES = {int: 'int64', float: 'float64', bool: 'bool', cast_to_bool: 'bool'}
+
+def make_column(col, cast=None, name=None, array=None):
+    if array is not None:
+        # the values are already in the array, which is quicker to convert
+        # than to gather from the rows
+        return ArrayColumn(array.tolist(), array, name=name)
+    if _backend == 'numpy' and cast in NUMPY_COLUMN_DTYPES:
+        col = tuple(col)
+        try:
+            array = numpy.array(col, dtype=NUMPY_COLUMN_DTYPES[cast])
+        except (OverflowError, TypeError, ValueError):
+            pass
+        else:
+            return ArrayColumn(col, array, name=name)
+    return CSVColumn(col, name=name)
+
+def _fit_rows(rows, num_fields):
+    # like csv.DictReader, skip blank lines, pad short rows with None and drop
+    # values past the last field
+    for row in rows:
+        if not row:
+            continue
+        if len(row) < num_fields:
+            row += [None] * (num_fields - len(row))
+        elif len(row) > num_fields:
+            del row[num_fields:]
+        yield row
+
+
+class CSVModel:
+    def __init__(self, rows, types=None):
+        self._set_rows(*get_engine()(rows, types))
+
+    def _set_rows(self, rows, types, arrays=None):
+        arrays = arrays or {}
         self.types = types
+        self._rows = tuple(map(self._init_row, rows))
+        self._cols = tuple(self._init_col(i, arrays.get(i)) for i in range(len(types)))
+        self.num_cols = len(types)
+        self.num_rows = len(self._rows)
+
+    @classmethod
+    def _from_parsed(cls, parsed):
+        # rows have already been cast by a parser engine
+        model = cls.__new__(cls)
+        model._set_rows(*parsed)
+        return model
 
     def _init_row(self, row):
         return CSVRow(row)
 
-    def _init_col(self, col_num):
-        return CSVColumn(row[col_num] for row in self._rows)
+    def _init_col(self, col_num, array=None):
+        return make_column((row[col_num] for row in self._rows), self.types[col_num], array=array)
 
     def cast(self, filters):
         return CSVModel(self._rows, types=tuple(filters))
@@ -227,16 +665,37 @@ class CSVModel:
     def itercols(self):
         return iter(self._cols)
 
+    def _column_index(self, column):
+        return column
+
+    def column(self, column):
+        return self._cols[self._column_index(column)]
+
+    def aggregate(self, column, fn):
+        _check_aggregate(fn)
+        return getattr(self.column(column), fn)()
+
+    def rolling(self, column, window, fn='mean'):
+        col = self.column(column)
+        return CSVColumn(rolling_aggregate(col, window, fn), name=col.fieldname)
+
+    def cumulative(self, column, fn='sum'):
+        col = self.column(column)
+        return CSVColumn(cumulative_aggregate(col, fn), name=col.fieldname)
+
+    def where(self, column, op, value):
+        return [self._rows[i] for i in self.column(column).indices_where(op, value)]
+
+    def sortedby(self, column):
+        return [self._rows[i] for i in self.column(column).argsort()]
+
     @classmethod
-    def from_file(cls, filename, types=None):
-        with open(filename) as csvfile:
-            reader = csv.reader(csvfile)
-            if types is None:
-                return cls(reader)
-            rows = []
-            for row in reader:
-                rows.append([cast(item) for cast, item in itertools.zip_longest(types, row)])
-            return cls(rows, types=types)
+    def from_file(cls, filename, types=None, engine=None, dialect='excel',
+                  encoding=None, buffer_size=DEFAULT_BUFFER_SIZE, stats=None):
+        parse = get_engine(engine)
+        with open_csv(filename, encoding=encoding, buffer_size=buffer_size) as csvfile:
+            parsed = parse(csv.reader(csvfile, dialect), types, stats=stats)
+        return cls._from_parsed(ParsedRows(*parsed))
 
 
 class CSVDictModel(CSVModel):
@@ -252,8 +711,9 @@ class CSVDictModel(CSVModel):
     def _init_row(self, row):
         return CSVDictRow(self.fieldnames, row)
 
-    def _init_col(self, col_num):
-        return CSVColumn((row[col_num] for row in self._rows), name=self.fieldnames[col_num])
+    def _init_col(self, col_num, array=None):
+        return make_column((row[col_num] for row in self._rows), self.types[col_num],
+                           name=self.fieldnames[col_num], array=array)
 
     def cast(self, filters):
         return CSVDictModel(self.fieldnames, self._rows, types=tuple(filters))
@@ -261,23 +721,33 @@ class CSVDictModel(CSVModel):
     def row_slice(self, start, end):
         return CSVDictModel(self.fieldnames, self._rows[start:end], types=self.types)
 
+    def _column_index(self, column):
+        if isinstance(column, str):
+            return self._rows[0]._getindex(column)
+        return column
+
     def col_slice(self, start, end):
         s = self._rows[0]._getslice(start, end)
         return CSVDictModel(self.fieldnames[s], (row[s] for row in self._rows),
                             types=self.types[s])
 
     @classmethod
-    def from_file(cls, filename, types=None):
-        with open(filename) as csvfile:
-            reader = csv.DictReader(csvfile)
-            rows = []
-            if types is None:
-                for row in reader:
-                    rows.append(tuple(row[field] for field in reader.fieldnames))
-                return cls(reader.fieldnames, rows)
-            for row in reader:
-                row_data = []
-                for cast, field in itertools.zip_longest(types, reader.fieldnames):
-                    row_data.append(cast(row[field]))
-                rows.append(row_data)
-            return cls(reader.fieldnames, rows, types=types)
+    def _from_parsed(cls, fieldnames, parsed):
+        model = cls.__new__(cls)
+        model.fieldnames = tuple(fieldnames)
+        model._set_rows(*parsed)
+        if not model._rows:
+            raise ValueError('rows cannot be empty!')
+        return model
+
+    @classmethod
+    def from_file(cls, filename, types=None, engine=None, dialect='excel',
+                  encoding=None, buffer_size=DEFAULT_BUFFER_SIZE, stats=None):
+        parse = get_engine(engine)
+        with open_csv(filename, encoding=encoding, buffer_size=buffer_size) as csvfile:
+            reader = csv.reader(csvfile, dialect)
+            fieldnames = next((row for row in reader if row), None)
+            if fieldnames is None:
+                raise ValueError('rows cannot be empty!')
+            parsed = parse(_fit_rows(reader, len(fieldnames)), types, stats=stats)
+        return cls._from_parsed(fieldnames, ParsedRows(*parsed))
@@ -1,6 +1,14 @@
+import bz2
 import csv
 from datetime import datetime
+import gzip
+import io
+import lzma
+import math
+import os
+import random
 import tempfile
+import threading
 import unittest
 
 from csv_model import CSVRow
@@ -8,8 +16,16 @@ from csv_model import CSVDictRow
 from csv_model import CSVModel
 from csv_model import CSVDictModel
 from csv_model import CSVColumn
+from csv_model import ArrayColumn
 from csv_model import cast_to_bool
 from csv_model import cast_to_date
+from csv_model import numpy
+from csv_model import ENGINES
+from csv_model import numpy_engine
+from csv_model import python_engine
+from csv_model import set_backend
+from csv_model import rolling_aggregate
+from csv_model import cumulative_aggregate
 
 class TestCSVRow(unittest.TestCase):
 
@@ -105,6 +121,117 @@ class TestCSVColumn(unittest.TestCase):
         self.assertNotEqual(self.col, range(6))
         self.assertNotEqual(self.col, [0, 3, 1, 2, 4])
 
+    def test_aggregates(self):
+        self.assertEqual(self.col.sum(), 10)
+        self.assertEqual(self.col.mean(), 2)
+        self.assertEqual(self.col.min(), 0)
+        self.assertEqual(self.col.max(), 4)
+        with self.assertRaises(ValueError):
+            CSVColumn([]).mean()
+
+    def test_indices_where(self):
+        self.assertEqual(self.col.indices_where('>', 2), [3, 4])
+        self.assertEqual(self.col.indices_where('==', 1), [1])
+        self.assertEqual(self.col.indices_where('!=', 1), [0, 2, 3, 4])
+        with self.assertRaises(ValueError):
+            self.col.indices_where('~', 1)
+
+    def test_argsort(self):
+        col = CSVColumn([3, 1, 2, 1])
+        self.assertEqual(col.argsort(), [1, 3, 2, 0])
+
+
+@unittest.skipIf(numpy is None, 'numpy is not installed')
+class TestArrayColumn(unittest.TestCase):
+
+    def setUp(self):
+        self.data = [
+            [3, -1, 7, 7, 0, 2**40],
+            [2.5, float('nan'), -1.0, 2.5, 0.0, 1e10],
+            [1.5, -0.0, 0.0, 2.25],
+            [True, False, True, True],
+            [-0.0, -0.0],
+            [2**53 + 1, 2**53, -2**53 - 1, 1],
+        ]
+        rng = random.Random(0)
+        self.data.append([rng.uniform(0, 56548) for _ in range(1000)])
+
+    def make_columns(self, data):
+        return CSVColumn(data), ArrayColumn(data, numpy.array(data))
+
+    def test_matches_python(self):
+        for data in self.data:
+            col, array_col = self.make_columns(data)
+            for fn in ['sum', 'mean', 'min', 'max']:
+                expected = getattr(col, fn)()
+                result = getattr(array_col, fn)()
+                self.assertEqual(type(result), type(expected), msg=(data, fn))
+                # repr tells 0.0 and -0.0 apart and makes NaNs equal
+                self.assertEqual(repr(result), repr(expected), msg=(data, fn))
+            self.assertEqual(array_col.argsort(), col.argsort(), msg=data)
+            for op in ['==', '!=', '<', '<=', '>', '>=']:
+                for value in [0, 2.5, True, 2**70, 'x', float(2**53), 2.0**53 + 2, 1.5, float('inf'), float('nan')]:
+                    if op not in ('==', '!=') and isinstance(value, str):
+                        continue
+                    self.assertEqual(array_col.indices_where(op, value), col.indices_where(op, value),
+                                     msg=(data, op, value))
+
+    def test_sum_overflow(self):
+        data = [2**62, 2**62, 2**62]
+        col, array_col = self.make_columns(data)
+        self.assertEqual(array_col.sum(), col.sum())
+
+
+
+@unittest.skipIf(numpy is None, 'numpy is not installed')
+class TestNumpyEngine(unittest.TestCase):
+
+    def assertEnginesAgree(self, col, types=None):
+        rows = [[v] for v in col]
+        expected = python_engine(rows, types)
+        result = numpy_engine(rows, types)
+        self.assertEqual(result.types, expected.types, msg=col)
+        self.assertEqual([[(type(v), repr(v)) for v in row] for row in result.rows],
+                         [[(type(v), repr(v)) for v in row] for row in expected.rows], msg=col)
+
+    def test_numeric_columns(self):
+        rows = [['1', '2.5', 'x'], ['-7', '1e3', 'y']]
+        result = numpy_engine(rows)
+        self.assertEqual(result.types, [int, float, str])
+        self.assertEqual(result.rows, [(1, 2.5, 'x'), (-7, 1000.0, 'y')])
+        self.assertEqual(sorted(result.arrays), [0, 1])
+        self.assertEqual(result.arrays[0].dtype, numpy.int64)
+
+    def test_matches_python_engine(self):
+        cols = [
+            ['1', '+2', '-0', '007'],
+            [' 5', '6'],
+            ['- 5', '1'],
+            ['1_000', '2'],
+            ['99999999999999999999', '1'],
+            ['', '1'],
+            ['1\n2', ''],
+            ['1-2', '3'],
+            ['1.5', '2', '-0', '1e400', '.5', '1.', '1E-3'],
+            ['inf', 'nan', '1'],
+            ['e5', '1'],
+            ['0x1', '2'],
+            ['true', 'no'],
+            ['2017-07-02', '7/2/2017'],
+        ]
+        for col in cols:
+            self.assertEnginesAgree(col)
+        for cast in [int, float, str]:
+            self.assertEnginesAgree(['1', '-2', '30'], [cast])
+        with self.assertRaises(ValueError):
+            numpy_engine([['1'], ['2.5']], [int])
+
+    def test_model_keeps_arrays(self):
+        model = CSVModel._from_parsed(numpy_engine([['1', '2.5', 'x'], ['2', '3.5', 'y']]))
+        self.assertIsInstance(model.column(0), ArrayColumn)
+        self.assertEqual(list(model.column(0)), [1, 2])
+        self.assertEqual(model.column(1).sum(), 6.0)
+        self.assertNotIsInstance(model.column(2), ArrayColumn)
 
 class TestCastFunctions(unittest.TestCase):
     def test_cast_to_bool(self):
@@ -139,6 +266,63 @@ class TestCastFunctions(unittest.TestCase):
                 cast_to_date(test_case)
 
 
+class TestWindowedAggregates(unittest.TestCase):
+
+    def setUp(self):
+        self.data = [5, 3, 8, 8, -2, 7, 1, 1, 9, 0]
+        self.naive = {
+            'sum': sum,
+            'mean': lambda values: sum(values) / len(values),
+            'min': min,
+            'max': max,
+        }
+
+    def test_rolling(self):
+        for fn, aggregate in self.naive.items():
+            for window in range(1, len(self.data) + 2):
+                expected = [aggregate(self.data[max(0, i - window + 1):i + 1])
+                            for i in range(len(self.data))]
+                self.assertEqual(rolling_aggregate(self.data, window, fn), expected, msg=(fn, window))
+
+    def test_rolling_floats(self):
+        # a running total that adds and subtracts would lose the small values
+        # next to the large ones
+        data = [1e16, 1.0, 1.0, 1.0, 0.1, 0.2, 0.3, -1e16, 1e-8, 2.5e-8, 1e100, 3.0, -1e100, 0.7]
+        self.assertEqual(rolling_aggregate([1e16, 1.0, 1.0, 1.0], 1, 'sum'), [1e16, 1.0, 1.0, 1.0])
+        self.assertEqual(rolling_aggregate([0.1, 0.2, 0.3], 1, 'sum'), [0.1, 0.2, 0.3])
+        for window in range(1, len(data) + 2):
+            windows = [data[max(0, i - window + 1):i + 1] for i in range(len(data))]
+            self.assertEqual(rolling_aggregate(data, window, 'sum'), [math.fsum(w) for w in windows],
+                             msg=window)
+            self.assertEqual(rolling_aggregate(data, window, 'mean'), [math.fsum(w) / len(w) for w in windows],
+                             msg=window)
+
+    def test_rolling_special_floats(self):
+        inf = float('inf')
+        result = rolling_aggregate([1.0, inf, 2.0, 3.0, -inf, inf, 1.0, float('nan'), 1.0], 2, 'sum')
+        self.assertEqual(result[:5], [1.0, inf, inf, 5.0, -inf])
+        self.assertTrue(math.isnan(result[5]))
+        self.assertEqual(result[6], inf)
+        self.assertTrue(math.isnan(result[7]) and math.isnan(result[8]))
+
+    def test_cumulative(self):
+        for fn, aggregate in self.naive.items():
+            expected = [aggregate(self.data[:i + 1]) for i in range(len(self.data))]
+            self.assertEqual(cumulative_aggregate(self.data, fn), expected, msg=fn)
+
+    def test_errors(self):
+        with self.assertRaises(ValueError):
+            rolling_aggregate(self.data, 0)
+        with self.assertRaises(ValueError):
+            rolling_aggregate(self.data, 2, 'median')
+        with self.assertRaises(ValueError):
+            cumulative_aggregate(self.data, 'median')
+
+    def test_empty(self):
+        self.assertEqual(rolling_aggregate([], 3), [])
+        self.assertEqual(cumulative_aggregate([]), [])
+
+
 def getValueTypeList(rows):
     return list((item, type(item)) for row in rows for item in row)
 
@@ -174,6 +358,61 @@ class TestCSVModel(unittest.TestCase):
             file_model = CSVModel.from_file(f.name)
             self.assertCSVModelsAreEqual(file_model, self.model)
 
+    def write_csv(self, f):
+        csv.writer(f).writerows(self.data)
+
+    def test_from_compressed_file(self):
+        for opener in [gzip.open, bz2.open, lzma.open]:
+            with tempfile.NamedTemporaryFile() as f:
+                with opener(f.name, 'wt', newline='') as compressed:
+                    self.write_csv(compressed)
+                file_model = type(self.model).from_file(f.name)
+                self.assertCSVModelsAreEqual(file_model, self.model, msg=opener.__module__)
+
+    def test_from_file_engines(self):
+        types = [str, float, int, bool, str, cast_to_bool]
+        with tempfile.NamedTemporaryFile(mode='w', newline='') as f:
+            self.write_csv(f)
+            f.flush()
+            expected = type(self.model).from_file(f.name)
+            expected_with_types = type(self.model).from_file(f.name, types=types)
+            for engine in ENGINES:
+                if engine == 'numpy' and numpy is None:
+                    continue
+                file_model = type(self.model).from_file(f.name, engine=engine)
+                self.assertCSVModelsAreEqual(file_model, expected, msg=engine)
+                self.assertEqual(file_model.types, expected.types, msg=engine)
+                file_model = type(self.model).from_file(f.name, types=types, engine=engine)
+                self.assertCSVModelsAreEqual(file_model, expected_with_types, msg=engine)
+
+    def test_from_file_dialect(self):
+        with tempfile.NamedTemporaryFile(mode='w', encoding='utf-16') as f:
+            csv.writer(f, delimiter='\t').writerows(self.data)
+            f.flush()
+            file_model = CSVModel.from_file(f.name, dialect='excel-tab', encoding='utf-16')
+            self.assertCSVModelsAreEqual(file_model, self.model)
+
+    def test_from_file_unknown_engine(self):
+        with self.assertRaises(ValueError):
+            CSVModel.from_file('unused.csv', engine='nosuchengine')
+
+    def test_from_pipe(self):
+        for opener in [None, gzip.compress, bz2.compress, lzma.compress]:
+            text = io.StringIO(newline='')
+            self.write_csv(text)
+            data = text.getvalue().encode()
+            if opener is not None:
+                data = opener(data)
+            read_fd, write_fd = os.pipe()
+            writer = threading.Thread(target=lambda: (os.write(write_fd, data), os.close(write_fd)))
+            writer.start()
+            try:
+                file_model = type(self.model).from_file('/dev/fd/{}'.format(read_fd))
+            finally:
+                writer.join()
+                os.close(read_fd)
+            self.assertCSVModelsAreEqual(file_model, self.model, msg=opener)
+
     def test_from_file_with_types(self):
         types = [str, float, int, bool, str, cast_to_bool]
         expected_results = [
@@ -275,6 +514,33 @@ class TestCSVModel(unittest.TestCase):
             errMsg = 'test case #{}'.format(idx)
             self.assertCSVModelsAreEqual(casted_model, test['expected'], msg=errMsg)
 
+    def test_aggregate(self):
+        self.assertAlmostEqual(self.model.aggregate(1, 'sum'), 19.74)
+        self.assertAlmostEqual(self.model.aggregate(1, 'mean'), 4.935)
+        self.assertEqual(self.model.aggregate(2, 'min'), 0)
+        self.assertEqual(self.model.aggregate(2, 'max'), 88)
+        self.assertEqual(self.model.aggregate(5, 'sum'), 2)
+        with self.assertRaises(ValueError):
+            self.model.aggregate(2, 'median')
+
+    def test_where(self):
+        self.assertEqual(self.model.where(2, '>', 1), [self.model.rows()[2], self.model.rows()[3]])
+        self.assertEqual(self.model.where(5, '==', True), [self.model.rows()[0], self.model.rows()[2]])
+        self.assertEqual(self.model.where(0, '==', 's'), [self.model.rows()[2]])
+        self.assertEqual(self.model.where(1, '<', 0), [])
+
+    def test_rolling(self):
+        self.assertEqual(self.model.rolling(2, 2, 'max'), [1, 1, 55, 88])
+        self.assertEqual(self.model.rolling(2, 3, 'sum'), [1, 1, 56, 143])
+        self.assertEqual(self.model.cumulative(2), [1, 1, 56, 144])
+        self.assertEqual(self.model.cumulative(2, 'min'), [1, 0, 0, 0])
+
+    def test_sortedby(self):
+        rows = self.model.rows()
+        for col in range(self.model.num_cols):
+            expected = sorted(rows, key=lambda row: row[col])
+            self.assertEqual(self.model.sortedby(col), expected, msg=col)
+
     def test_row_slice(self):
         expected_results = [
             ['Bye', 9.0, 0, 'eh', '9.5', False],
@@ -309,6 +575,10 @@ class TestCSVDictModel(TestCSVModel):
         ]
         self.model = CSVDictModel(self.fieldnames, self.data)
 
+    def write_csv(self, f):
+        writer = csv.writer(f)
+        writer.writerow(self.fieldnames)
+        writer.writerows(self.data)
 
     def test_from_file(self):
         with tempfile.NamedTemporaryFile(mode='w') as f:
@@ -321,6 +591,27 @@ class TestCSVDictModel(TestCSVModel):
             self.assertCSVModelsAreEqual(file_model, self.model)
             self.assertEqual(file_model.fieldnames, self.model.fieldnames)
 
+    def test_from_file_ragged_rows(self):
+        lines = ['a,b,c', '', '1,2,3', '4,5', '6,7,8,9']
+        with tempfile.NamedTemporaryFile(mode='w') as f:
+            f.write('\n'.join(lines) + '\n')
+            f.flush()
+            for engine in ENGINES:
+                if engine == 'numpy' and numpy is None:
+                    continue
+                file_model = CSVDictModel.from_file(f.name, types=[int, int, str], engine=engine)
+                self.assertCSVModelsAreEqual(file_model, [[1, 2, '3'], [4, 5, 'None'], [6, 7, '8']], msg=engine)
+
+    def test_from_file_like_compressed(self):
+        # plain CSVs that begin with part of a compression header
+        for header in ['BZh_code', 'BZh9_code', '\x1f\x8bcode']:
+            with tempfile.NamedTemporaryFile(mode='w', encoding='latin-1', newline='') as f:
+                f.write('{},score\nx,1\n'.format(header))
+                f.flush()
+                file_model = CSVDictModel.from_file(f.name, encoding='latin-1')
+            self.assertEqual(file_model.fieldnames, (header, 'score'))
+            self.assertCSVModelsAreEqual(file_model, [['x', 1]], msg=header)
+
     def test_from_file_with_types(self):
         types = [str, float, int, bool, str, cast_to_bool]
         expected_results = [
@@ -402,6 +693,12 @@ class TestCSVDictModel(TestCSVModel):
             errMsg = 'test case #{}'.format(idx)
             self.assertCSVModelsAreEqual(casted_model, test['expected'], msg=errMsg)
 
+    def test_aggregate_fieldnames(self):
+        self.assertEqual(self.model.aggregate('Score', 'max'), 88)
+        self.assertEqual(self.model.where('Greeting', '==', 'Bye'), [self.model.rows()[1]])
+        with self.assertRaises(KeyError):
+            self.model.column('Missing')
+
     def test_col_slice(self):
         super(TestCSVDictModel, self).test_col_slice()
         expected_results = [
@@ -421,5 +718,33 @@ class TestCSVDictModel(TestCSVModel):
         self.assertEqual(expected, str(self.model))
 
 
+@unittest.skipIf(numpy is None, 'numpy is not installed')
+class TestCSVModelNumpyBackend(TestCSVModel):
+
+    def setUp(self):
+        set_backend('numpy')
+        super().setUp()
+
+    def tearDown(self):
+        set_backend('python')
+
+    def test_array_columns(self):
+        self.assertIsInstance(self.model.column(1), ArrayColumn)
+        self.assertIsInstance(self.model.column(2), ArrayColumn)
+        self.assertIsInstance(self.model.column(5), ArrayColumn)
+        self.assertNotIsInstance(self.model.column(0), ArrayColumn)
+
+
+@unittest.skipIf(numpy is None, 'numpy is not installed')
+class TestCSVDictModelNumpyBackend(TestCSVDictModel):
+
+    def setUp(self):
+        set_backend('numpy')
+        super().setUp()
+
+    def tearDown(self):
+        set_backend('python')
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,141 @@
+import collections
+import json
+import os
+import socketserver
+import stat
+import threading
+
+from csv_client import FRAME_DATA, FRAME_END, FRAME_ERROR
+from csv_client import connect, default_socket_path, make_socket_dir, peer_uid, write_frame
+from csv_model import CSVDictModel
+from csv_view import CSVJinjaView
+
+
+# rendered output is sent in frames of roughly this many bytes
+CHUNK_SIZE = 64 * 1024
+
+
+class LRUCache:
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, factory):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                return self._data[key]
+        # build outside of the lock so a slow load doesn't block cache hits
+        value = factory()
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return value
+
+
+class RenderCache:
+    """Keeps loaded models and warm views around between renders.
+
+    Models are keyed on the file's path, mtime and size so an edited CSV is
+    reloaded. Compiled templates are cached by each view's environment, which
+    also reloads templates that changed on disk.
+    """
+
+    def __init__(self, max_models=32, max_views=8, max_templates=400):
+        self.max_templates = max_templates
+        self._models = LRUCache(max_models)
+        self._views = LRUCache(max_views)
+
+    def model(self, csvfile):
+        stat = os.stat(csvfile)
+        key = (os.path.realpath(csvfile), stat.st_mtime_ns, stat.st_size)
+        return self._models.get(key, lambda: CSVDictModel.from_file(csvfile))
+
+    def view(self, template_path):
+        def make_view():
+            env_options = {'cache_size': self.max_templates}
+            return CSVJinjaView(template_path=template_path, env_options=env_options)
+        return self._views.get(template_path, make_view)
+
+    def generate(self, csvfile, templatefile, template_path=None, **kwargs):
+        model = self.model(csvfile)
+        view = self.view(template_path or os.getcwd())
+        return view.generate_jinja_template(templatefile, model, **kwargs)
+
+
+class RenderRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+            chunks = self.server.cache.generate(
+                request['csvfile'], request['template'],
+                request.get('template_path'), **request.get('kwargs', {}))
+            buf = []
+            size = 0
+            for chunk in chunks:
+                buf.append(chunk)
+                size += len(chunk)
+                if size >= CHUNK_SIZE:
+                    write_frame(self.wfile, FRAME_DATA, ''.join(buf).encode('utf-8'))
+                    buf = []
+                    size = 0
+            if buf:
+                write_frame(self.wfile, FRAME_DATA, ''.join(buf).encode('utf-8'))
+        except Exception as e:
+            msg = '{}: {}'.format(type(e).__name__, e)
+            write_frame(self.wfile, FRAME_ERROR, msg.encode('utf-8'))
+            return
+        write_frame(self.wfile, FRAME_END)
+
+
+class RenderServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path=None, cache=None):
+        if socket_path is None:
+            socket_path = default_socket_path()
+            make_socket_dir(socket_path)
+        if os.path.lexists(socket_path):
+            sock = connect(socket_path)
+            if sock is not None:
+                sock.close()
+                raise RuntimeError('a render server is already listening on {}'.format(socket_path))
+            if not stat.S_ISSOCK(os.lstat(socket_path).st_mode):
+                raise RuntimeError('{} exists and is not a socket'.format(socket_path))
+            # left behind by a server that didn't shut down cleanly
+            os.unlink(socket_path)
+        self.cache = RenderCache() if cache is None else cache
+        super().__init__(socket_path, RenderRequestHandler)
+
+    def server_bind(self):
+        super().server_bind()
+        # requests name files to read, so only the user may connect
+        os.chmod(self.server_address, 0o600)
+
+    def verify_request(self, request, client_address):
+        uid = peer_uid(request)
+        return uid is None or uid == os.getuid()
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.server_address)
+        except FileNotFoundError:
+            pass
+
+
+def serve(socket_path=None):
+    with RenderServer(socket_path) as server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
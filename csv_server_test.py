@@ -0,0 +1,160 @@
+import io
+import os
+import socket
+import stat
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from csv_client import RenderServerError
+from csv_client import default_socket_path
+from csv_client import make_socket_dir
+from csv_client import render_remote
+from csv_model import CSVDictModel
+from csv_server import LRUCache
+from csv_server import RenderServer
+from csv_view import CSVJinjaView
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_get(self):
+        cache = LRUCache(maxsize=2)
+        self.assertEqual(cache.get('a', lambda: 1), 1)
+        self.assertEqual(cache.get('a', lambda: 2), 1)
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(maxsize=2)
+        cache.get('a', lambda: 1)
+        cache.get('b', lambda: 2)
+        cache.get('a', lambda: 1)
+        cache.get('c', lambda: 3)
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertIn('c', cache)
+        self.assertEqual(len(cache), 2)
+
+
+class TestRenderServer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.csvfile = os.path.join(self.tmpdir.name, 'data.csv')
+        with open(self.csvfile, 'w') as f:
+            f.write('Name,Score\nBob,1\nJoe,2\n')
+        with open(os.path.join(self.tmpdir.name, 'hello.template'), 'w') as f:
+            f.write('{% for row in rows %}\n{{ row.Name }}={{ row.Score * 2 }}\n{% endfor %}\n')
+        with open(os.path.join(self.tmpdir.name, 'broken.template'), 'w') as f:
+            f.write('{{ rows|nosuchfilter }}')
+        self.socket_path = os.path.join(self.tmpdir.name, 'render.sock')
+        self.server = RenderServer(self.socket_path)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        self.tmpdir.cleanup()
+
+    def render(self, template):
+        out = io.BytesIO()
+        served = render_remote(self.csvfile, template, out,
+                               template_path=self.tmpdir.name, socket_path=self.socket_path)
+        self.assertTrue(served)
+        return out.getvalue().decode('utf-8')
+
+    def test_matches_in_process_render(self):
+        view = CSVJinjaView(template_path=self.tmpdir.name)
+        expected = view.render_jinja_template('hello.template', CSVDictModel.from_file(self.csvfile))
+        self.assertEqual(self.render('hello.template'), expected)
+        # the second render is served from the warm caches
+        self.assertEqual(self.render('hello.template'), expected)
+
+    def test_reloads_changed_csv(self):
+        self.render('hello.template')
+        with open(self.csvfile, 'w') as f:
+            f.write('Name,Score\nAmy,10\n')
+        self.assertEqual(self.render('hello.template'), 'Amy=20\n')
+
+    def test_error(self):
+        with self.assertRaises(RenderServerError):
+            self.render('broken.template')
+
+    def test_no_server(self):
+        out = io.BytesIO()
+        missing = os.path.join(self.tmpdir.name, 'missing.sock')
+        self.assertFalse(render_remote(self.csvfile, 'hello.template', out, socket_path=missing))
+        self.assertEqual(out.getvalue(), b'')
+
+    def test_socket_is_private(self):
+        self.assertEqual(stat.S_IMODE(os.stat(self.socket_path).st_mode), 0o600)
+
+    def test_untrusted_socket(self):
+        # a socket owned by someone else could be a server that lies
+        out = io.BytesIO()
+        with mock.patch('csv_client.os.getuid', return_value=os.getuid() + 1):
+            served = render_remote(self.csvfile, 'hello.template', out,
+                                   template_path=self.tmpdir.name, socket_path=self.socket_path)
+        self.assertFalse(served)
+        self.assertEqual(out.getvalue(), b'')
+
+    def test_connect_error(self):
+        out = io.BytesIO()
+        with mock.patch('csv_client.socket.socket') as sock:
+            sock.return_value.connect.side_effect = PermissionError
+            served = render_remote(self.csvfile, 'hello.template', out,
+                                   template_path=self.tmpdir.name, socket_path=self.socket_path)
+        self.assertFalse(served)
+
+    def test_timeout(self):
+        # a server that accepts connections but never answers
+        silent_path = os.path.join(self.tmpdir.name, 'silent.sock')
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as silent:
+            silent.bind(silent_path)
+            silent.listen(1)
+            with self.assertRaises(RenderServerError):
+                render_remote(self.csvfile, 'hello.template', io.BytesIO(),
+                              template_path=self.tmpdir.name, socket_path=silent_path, timeout=0.1)
+
+
+class TestSocketPath(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_default_socket_path(self):
+        env = {'XDG_RUNTIME_DIR': self.tmpdir.name}
+        with mock.patch.dict(os.environ, env, clear=True):
+            self.assertEqual(default_socket_path(), os.path.join(self.tmpdir.name, 'jinja_csv.sock'))
+        with mock.patch.dict(os.environ, {}, clear=True), \
+                mock.patch('csv_client.tempfile.gettempdir', return_value=self.tmpdir.name):
+            path = default_socket_path()
+        self.assertEqual(os.path.dirname(os.path.dirname(path)), self.tmpdir.name)
+
+    def test_make_socket_dir(self):
+        path = os.path.join(self.tmpdir.name, 'private', 'render.sock')
+        make_socket_dir(path)
+        self.assertEqual(stat.S_IMODE(os.stat(os.path.dirname(path)).st_mode), 0o700)
+        # an existing directory others can read isn't used
+        shared = os.path.join(self.tmpdir.name, 'shared')
+        os.mkdir(shared)
+        os.chmod(shared, 0o755)
+        with self.assertRaises(RuntimeError):
+            make_socket_dir(os.path.join(shared, 'render.sock'))
+
+    def test_not_a_socket(self):
+        path = os.path.join(self.tmpdir.name, 'render.sock')
+        with open(path, 'w') as f:
+            f.write('keep me')
+        with self.assertRaises(RuntimeError):
+            RenderServer(path)
+        self.assertTrue(os.path.exists(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import contextlib
+import functools
+import json
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+class RenderStats:
+    """Collects where the time of a render went.
+
+    Pass one to the render functions to fill it in; without one nothing is
+    timed.
+    """
+
+    def __init__(self):
+        self.phases = {}
+        self.rows = 0
+        self.filters = {}
+        self.peak_memory = None
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def wrap_filter(self, name, func):
+        counts = self.filters.setdefault(name, {'calls': 0, 'seconds': 0.0})
+        # functools.wraps also copies the attributes jinja2 marks filters with
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                counts['calls'] += 1
+                counts['seconds'] += time.perf_counter() - start
+        return timed
+
+    def record_peak_memory(self):
+        if resource is None:
+            return
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and in kilobytes everywhere else
+        self.peak_memory = peak if sys.platform == 'darwin' else peak * 1024
+
+    def to_dict(self):
+        return {
+            'phases': dict(self.phases),
+            'rows': self.rows,
+            'filters': {name: dict(counts) for name, counts in self.filters.items()},
+            'peak_memory': self.peak_memory,
+        }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2, sort_keys=True)
+
+
+def _no_phase(name):
+    return contextlib.nullcontext()
+
+def phase_timer(stats):
+    return _no_phase if stats is None else stats.phase
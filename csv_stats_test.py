@@ -0,0 +1,64 @@
+import os
+import tempfile
+import unittest
+
+from jinja2 import FunctionLoader
+
+from csv_model import CSVDictModel
+from csv_model import CSVModel
+from csv_stats import RenderStats
+from csv_view import CSVJinjaView
+from jinja_csv import render_template_from_csv
+
+
+class TestRenderStats(unittest.TestCase):
+
+    def setUp(self):
+        self.stats = RenderStats()
+
+    def test_phase(self):
+        with self.stats.phase('parse'):
+            pass
+        first = self.stats.phases['parse']
+        with self.stats.phase('parse'):
+            pass
+        self.assertGreater(self.stats.phases['parse'], first)
+
+    def test_wrap_filter(self):
+        wrapped = self.stats.wrap_filter('double', lambda x: x * 2)
+        self.assertEqual(wrapped(2), 4)
+        self.assertEqual(wrapped(3), 6)
+        self.assertEqual(self.stats.filters['double']['calls'], 2)
+
+    def test_view_filters(self):
+        view = CSVJinjaView(env_options={'loader': FunctionLoader(lambda x:x)}, stats=self.stats)
+        model = CSVModel([['1', 'b'], ['2', 'a']])
+        view.render_jinja_template('{{ rows|sortedby(1)|length }}{{ rows|rowrange(1) }}', model)
+        self.assertEqual(self.stats.filters['sortedby']['calls'], 1)
+        self.assertEqual(self.stats.filters['rowrange']['calls'], 1)
+        self.assertEqual(self.stats.filters['cast']['calls'], 0)
+
+    def test_from_file(self):
+        with tempfile.NamedTemporaryFile(mode='w') as f:
+            f.write('a,b\n1,x\n2,y\n')
+            f.flush()
+            CSVDictModel.from_file(f.name, stats=self.stats)
+        self.assertEqual(set(self.stats.phases), {'parse', 'infer', 'cast'})
+
+    def test_render_template_from_csv(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            csvfile = os.path.join(tmpdir, 'data.csv')
+            with open(csvfile, 'w') as f:
+                f.write('a,b\n1,x\n2,y\n')
+            with open(os.path.join(tmpdir, 'rows.template'), 'w') as f:
+                f.write('{{ rows|sortedby("b")|length }}')
+            output = render_template_from_csv(csvfile, 'rows.template', template_path=tmpdir, stats=self.stats)
+        self.assertEqual(output, '2')
+        stats = self.stats.to_dict()
+        self.assertEqual(stats['rows'], 2)
+        self.assertIn('render', stats['phases'])
+        self.assertEqual(stats['filters']['sortedby']['calls'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
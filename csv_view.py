@@ -1,11 +1,22 @@
+import asyncio
+import functools
+import os
+
 import jinja2
+import jinja2.meta
 
+from csv_model import CSVDictModel
+from csv_model import CSVModel
+from csv_model import CSVColumn
 from csv_model import cast_to_bool
+from csv_model import cumulative_aggregate
+from csv_model import get_operator
+from csv_model import rolling_aggregate
 from csv_model import cast_to_date
 
 
 class CSVJinjaView:
-    def __init__(self, env=None, template_path=None, env_options=None, view_options=None):
+    def __init__(self, env=None, template_path=None, env_options=None, view_options=None, stats=None):
         if env is None:
             if env_options is None:
                 env_options = {}
@@ -22,6 +33,7 @@ class CSVJinjaView:
             }
         self.default_datetime_fmt = view_options['default_datetime_fmt']
         self.env = env
+        self.stats = stats
         self._register_filters()
 
     def _register_filters(self):
@@ -32,19 +44,53 @@ class CSVJinjaView:
             'columnrange': column_range,
             'getcolumns': columns,
             'sortedby': sortedby,
+            'where': where,
+            'aggregate': aggregate,
+            'sumcolumns': sum_columns,
+            'rolling': rolling,
+            'cumulative': cumulative,
             'bool': cast_to_bool,
             'date': cast_to_date,
             'dateformat': self.dateformat,
         }
+        if self.stats is not None:
+            filters = {name: self.stats.wrap_filter(name, f) for name, f in filters.items()}
         self.env.filters.update(filters)
+        self.env.globals['zip'] = zip
 
     def render_jinja_template(self, template_name, model, **kwargs):
         return self.env.get_template(template_name).render(
                     rows=model, **kwargs)
 
+    def generate_jinja_template(self, template_name, model, **kwargs):
+        return self.env.get_template(template_name).generate(
+                    rows=model, **kwargs)
+
     def render_template_for_rows(self, template_name, model, rowkey, **kwargs):
+        return self.render_template_for_selected_rows(template_name, model, model, rowkey, **kwargs)
+
+    def render_template_for_selected_rows(self, template_name, model, rows, rowkey, **kwargs):
         template = self.env.get_template(template_name)
-        return list((row[rowkey], template.render(row=row, fieldnames=model.fieldnames, **kwargs)) for row in model)
+        return list((row[rowkey], template.render(row=row, fieldnames=model.fieldnames, **kwargs)) for row in rows)
+
+    def template_sources(self, template_name):
+        """Return the sources of a template and every template it extends,
+        includes or imports, keyed by name.
+
+        Templates referenced through a variable can't be found this way and
+        are left out.
+        """
+        sources = {}
+        pending = [template_name]
+        while pending:
+            name = pending.pop()
+            if name in sources:
+                continue
+            source = self.env.loader.get_source(self.env, name)[0]
+            sources[name] = source
+            pending.extend(ref for ref in jinja2.meta.find_referenced_templates(self.env.parse(source))
+                           if ref is not None)
+        return sources
 
     def cast(self, rows, filters):
         return rows.cast(list(self.env.filters.get(f, str) for f in filters))
@@ -55,6 +101,82 @@ class CSVJinjaView:
     def dateformat(self, dt, fmt=None):
         return dt.strftime(fmt or self.default_datetime_fmt)
 
+
+class AsyncCSVJinjaView(CSVJinjaView):
+    """A view for use inside an asyncio event loop.
+
+    Models are loaded in an executor, at most max_concurrency renders run at
+    once, and renders hand control back to the event loop as they go so a
+    long render doesn't hold up the others.
+    """
+
+    # output events rendered between handing control back to the event loop
+    YIELD_EVERY = 256
+
+    def __init__(self, env=None, template_path=None, env_options=None, view_options=None,
+                 stats=None, max_concurrency=8, executor=None):
+        if env is None:
+            env_options = dict(env_options or {})
+            env_options['enable_async'] = True
+        elif not env.is_async:
+            raise ValueError('AsyncCSVJinjaView needs an environment with enable_async=True')
+        super().__init__(env, template_path, env_options, view_options, stats)
+        self.executor = executor
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def load_model(self, filename, model_cls=CSVDictModel, **kwargs):
+        loop = asyncio.get_running_loop()
+        load = functools.partial(model_cls.from_file, filename, **kwargs)
+        return await loop.run_in_executor(self.executor, load)
+
+    async def generate_jinja_template_async(self, template_name, model, chunk_size=64*1024, **kwargs):
+        template = self.env.get_template(template_name)
+        events = template.generate_async(rows=model, **kwargs)
+        try:
+            while True:
+                # only hold a slot while rendering, so a consumer that is slow
+                # to take the next chunk doesn't block other renders
+                async with self._semaphore:
+                    chunk, done = await self._next_chunk(events, chunk_size)
+                if chunk:
+                    yield chunk
+                if done:
+                    return
+        finally:
+            await events.aclose()
+
+    async def _next_chunk(self, events, chunk_size):
+        buf = []
+        size = 0
+        count = 0
+        while size < chunk_size:
+            try:
+                event = await events.__anext__()
+            except StopAsyncIteration:
+                return ''.join(buf), True
+            buf.append(event)
+            size += len(event)
+            count += 1
+            if count % self.YIELD_EVERY == 0:
+                await asyncio.sleep(0)
+        return ''.join(buf), False
+
+    async def render_jinja_template_async(self, template_name, model, **kwargs):
+        chunks = []
+        async for chunk in self.generate_jinja_template_async(template_name, model, **kwargs):
+            chunks.append(chunk)
+        return ''.join(chunks)
+
+    async def render_template_for_rows_async(self, template_name, model, rowkey, **kwargs):
+        async with self._semaphore:
+            template = self.env.get_template(template_name)
+            outputs = []
+            for row in model:
+                output = await template.render_async(row=row, fieldnames=model.fieldnames, **kwargs)
+                outputs.append((row[rowkey], output))
+                await asyncio.sleep(0)
+            return outputs
+
 def row_range(rows, start=None, end=None):
     return rows.row_slice(start, end)
 
@@ -67,7 +189,33 @@ def columns(rows, column_list=None):
         return cols
     return [cols[idx] for idx in column_list]
 
+def aggregate(rows, column, fn='sum'):
+    return rows.aggregate(column, fn)
+
+def sum_columns(rows, column_list):
+    return sum(rows.aggregate(column, 'sum') for column in column_list)
+
+# rolling and cumulative also take the list of rows sortedby and where return
+
+def rolling(rows, column, window, fn='mean'):
+    if isinstance(rows, CSVModel):
+        return rows.rolling(column, window, fn)
+    return CSVColumn(rolling_aggregate((row[column] for row in rows), window, fn))
+
+def cumulative(rows, column, fn='sum'):
+    if isinstance(rows, CSVModel):
+        return rows.cumulative(column, fn)
+    return CSVColumn(cumulative_aggregate((row[column] for row in rows), fn))
+
+def where(rows, column, op, value):
+    if isinstance(rows, CSVModel):
+        return rows.where(column, op, value)
+    compare = get_operator(op)
+    return [row for row in rows if compare(row[column], value)]
+
 def sortedby(rows, sortkeys):
+    if isinstance(rows, CSVModel) and isinstance(sortkeys, (int, str)):
+        return rows.sortedby(sortkeys)
     def keyfunc(row):
         if isinstance(sortkeys, int) or isinstance(sortkeys, str):
             return row[sortkeys]
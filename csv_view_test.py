@@ -1,11 +1,13 @@
+import asyncio
 from datetime import datetime
+import tempfile
 import unittest
 
 from dateutil import parser
 from jinja2 import FunctionLoader
 
-from csv_model import CSVModel, cast_to_date
-from csv_view import CSVJinjaView
+from csv_model import CSVDictModel, CSVModel, cast_to_date
+from csv_view import AsyncCSVJinjaView, CSVJinjaView
 
 class TestViewFilters(unittest.TestCase):
 
@@ -76,6 +78,96 @@ class TestViewFilters(unittest.TestCase):
         expected = str(self.model.col_slice(2, 3))
         self.assertEqual(expected, self.view.render_jinja_template(template, self.model))
 
+    def test_aggregate(self):
+        template = '{{ rows | aggregate(0) }} {{ rows | aggregate(0, "max") }}'
+        self.assertEqual('6 3', self.view.render_jinja_template(template, self.model))
+
+    def test_sumcolumns(self):
+        template = '{{ rows | sumcolumns([0, 0]) }}'
+        self.assertEqual('12', self.view.render_jinja_template(template, self.model))
+
+    def test_where(self):
+        template = '{% for row in rows | where(0, ">=", 2) %}{{ row[1] }} {% endfor %}'
+        self.assertEqual('bye heh ', self.view.render_jinja_template(template, self.model))
+        template = '{% for row in rows | sortedby(4) | where(1, "!=", "bye") %}{{ row[1] }} {% endfor %}'
+        self.assertEqual('hi heh ', self.view.render_jinja_template(template, self.model))
+
+    def test_sortedby(self):
+        template = '{% for row in rows | sortedby(1) %}{{ row[1] }} {% endfor %}'
+        self.assertEqual('bye heh hi ', self.view.render_jinja_template(template, self.model))
+
+    def test_rolling(self):
+        template = ('{% set sorted = rows | sortedby(3) %}'
+                    '{% for row, avg in zip(sorted, sorted | rolling(0, 2)) %}{{ avg }} {% endfor %}')
+        self.assertEqual('2.0 1.5 2.0 ', self.view.render_jinja_template(template, self.model))
+
+    def test_cumulative(self):
+        template = '{% for row, total in zip(rows, rows | cumulative(0)) %}{{ total }} {% endfor %}'
+        self.assertEqual('1 3 6 ', self.view.render_jinja_template(template, self.model))
+
+
+class TestAsyncView(unittest.TestCase):
+
+    def setUp(self):
+        loader = FunctionLoader(lambda x:x)
+        self.view = AsyncCSVJinjaView(env_options={'loader': loader})
+        self.sync_view = CSVJinjaView(env_options={'loader': loader})
+        self.model = CSVDictModel(['id', 'name'], [[str(i), 'name{}'.format(i)] for i in range(1000)])
+        self.template = '{% for row in rows %}{{ row.id }}: {{ row.name|upper }}\n{% endfor %}'
+
+    def test_render(self):
+        expected = self.sync_view.render_jinja_template(self.template, self.model)
+        output = asyncio.run(self.view.render_jinja_template_async(self.template, self.model))
+        self.assertEqual(output, expected)
+
+    def test_generate_chunks(self):
+        async def collect():
+            return [chunk async for chunk in self.view.generate_jinja_template_async(
+                        self.template, self.model, chunk_size=100)]
+        chunks = asyncio.run(collect())
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(''.join(chunks), self.sync_view.render_jinja_template(self.template, self.model))
+
+    def test_render_for_rows(self):
+        template = '{{ row.name }}'
+        expected = self.sync_view.render_template_for_rows(template, self.model, 'id')
+        output = asyncio.run(self.view.render_template_for_rows_async(template, self.model, 'id'))
+        self.assertEqual(output, expected)
+
+    def test_load_model(self):
+        with tempfile.NamedTemporaryFile(mode='w') as f:
+            f.write('a,b\n1,x\n2,y\n')
+            f.flush()
+            model = asyncio.run(self.view.load_model(f.name))
+        self.assertEqual(model.fieldnames, ('a', 'b'))
+        self.assertEqual(list(model.rows()), [[1, 'x'], [2, 'y']])
+
+    def test_slow_render_does_not_block(self):
+        finished = []
+        async def render(name, model):
+            await self.view.render_jinja_template_async(self.template, model)
+            finished.append(name)
+        async def main():
+            await asyncio.gather(render('slow', self.model), render('fast', self.model.row_slice(0, 1)))
+        asyncio.run(main())
+        self.assertEqual(finished, ['fast', 'slow'])
+
+    def test_suspended_consumer_does_not_block(self):
+        view = AsyncCSVJinjaView(env_options={'loader': FunctionLoader(lambda x:x)}, max_concurrency=1)
+        async def main():
+            chunks = view.generate_jinja_template_async(self.template, self.model, chunk_size=100)
+            # take one chunk and leave the generator suspended
+            await chunks.__anext__()
+            try:
+                return await asyncio.wait_for(view.render_jinja_template_async('{{ rows|length }}', self.model), 5)
+            finally:
+                await chunks.aclose()
+        self.assertEqual(asyncio.run(main()), '1000')
+
+    def test_requires_async_env(self):
+        with self.assertRaises(ValueError):
+            AsyncCSVJinjaView(env=self.sync_view.env)
+
 
 if __name__ == '__main__':
     unittest.main()
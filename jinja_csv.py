@@ -1,29 +1,194 @@
+import argparse
+import collections
+import hashlib
+import json
 import os
 import sys
+import time
 
-from csv_model import CSVDictModel
+import csv_client
+from csv_stats import RenderStats, phase_timer
 
 
-def render_template_from_csv(csvfile, templatefile, template_path=None, options=None, **kwargs):
-    model = CSVDictModel.from_file(csvfile)
-    view = CSVJinjaView(template_path=template_path, options=options)
-    return view.render_jinja_template(templatefile, model, **kwargs)
+# csv_model and csv_view are imported where they are used so that handing a
+# render off to a running server doesn't pay for importing jinja2 and dateutil.
+# Both render functions fill in stats, a csv_stats.RenderStats, when given one.
 
 
-def render_template_per_row(csvfile, templatefile, filemapper, template_path=None, options=None, rowkey=0, **kwargs):
-    model = CSVDictModel.from_file(csvfile)
-    view = CSVJinjaView(template_path=template_path, options=options)
-    for output in view.render_template_for_rows(templatefile, model, rowkey, **kwargs):
-        with open(filemapper(output[0]), 'w') as fp:
-            fp.write(output[1])
+def render_template_from_csv(csvfile, templatefile, template_path=None, options=None, stats=None, **kwargs):
+    from csv_model import CSVDictModel
+    from csv_view import CSVJinjaView
+    phase = phase_timer(stats)
+    model = CSVDictModel.from_file(csvfile, stats=stats)
+    view = CSVJinjaView(template_path=template_path, view_options=options, stats=stats)
+    with phase('render'):
+        output = view.render_jinja_template(templatefile, model, **kwargs)
+    if stats is not None:
+        stats.rows += len(model)
+        stats.record_peak_memory()
+    return output
 
 
-def main():
-    csvfile = sys.argv[1]
-    templatefile = sys.argv[2]
-    #output_path = sys.argv[3]
-    output = render_template_from_csv(csvfile, templatefile)
+def render_template_per_row(csvfile, templatefile, filemapper, template_path=None, options=None, rowkey=0,
+                            stats=None, manifest=None, **kwargs):
+    """Render templatefile once per row into the file filemapper(row[rowkey]).
+
+    With a manifest file, only rows whose data, templates, options or kwargs
+    changed since the last run with that manifest are rendered, and the
+    outputs of rows that are gone are deleted.
+    """
+    from csv_model import CSVDictModel
+    from csv_view import CSVJinjaView
+    phase = phase_timer(stats)
+    model = CSVDictModel.from_file(csvfile, stats=stats)
+    view = CSVJinjaView(template_path=template_path, view_options=options, stats=stats)
+    _check_unique((row[rowkey] for row in model), 'rowkey values')
+    # two keys mapping to one file, like 'Bob X' and 'bob x' under a
+    # lowercasing filemapper, would overwrite each other's output
+    _check_unique((os.path.normcase(os.path.abspath(filemapper(row[rowkey]))) for row in model),
+                  'filemapper outputs')
+    rows = model
+    if manifest is not None:
+        with phase('hash'):
+            previous = load_row_manifest(manifest)
+            entries = row_manifest_entries(view, templatefile, model, filemapper, rowkey, options, kwargs)
+            rows = [row for row in model if _row_changed(previous, entries, str(row[rowkey]))]
+    with phase('render'):
+        outputs = view.render_template_for_selected_rows(templatefile, model, rows, rowkey, **kwargs)
+    with phase('write'):
+        for output in outputs:
+            with open(filemapper(output[0]), 'w') as fp:
+                fp.write(output[1])
+        if manifest is not None:
+            current = set(entry['output'] for entry in entries.values())
+            for key, entry in previous.items():
+                if entry['output'] in current or not os.path.exists(entry['output']):
+                    continue
+                # the row is gone or now renders to another file, unless the
+                # new name is the same file on a case-insensitive filesystem
+                output = entries[key]['output'] if key in entries else None
+                if output is None or not (os.path.exists(output) and os.path.samefile(output, entry['output'])):
+                    os.remove(entry['output'])
+            save_row_manifest(manifest, entries)
+    if stats is not None:
+        stats.rows += len(model)
+        stats.record_peak_memory()
+
+
+def _check_unique(values, what):
+    counts = collections.Counter(values)
+    duplicates = [str(value) for value, count in counts.items() if count > 1]
+    if duplicates:
+        raise ValueError('{} should be unique, but these repeat: {}'.format(what, ', '.join(duplicates)))
+
+
+def _row_changed(previous, entries, key):
+    entry = entries[key]
+    return previous.get(key) != entry or not os.path.exists(entry['output'])
+
+
+def row_manifest_entries(view, templatefile, model, filemapper, rowkey, options, kwargs):
+    # everything but the row itself is hashed once and shared by every row
+    common = hashlib.sha256()
+    for name, source in sorted(view.template_sources(templatefile).items()):
+        common.update(repr((name, source)).encode('utf-8'))
+    common.update(repr((model.fieldnames, options, sorted(kwargs.items()))).encode('utf-8'))
+    entries = collections.OrderedDict()
+    for row in model:
+        digest = common.copy()
+        digest.update(repr(tuple(row)).encode('utf-8'))
+        entries[str(row[rowkey])] = {'hash': digest.hexdigest(), 'output': filemapper(row[rowkey])}
+    return entries
+
+
+def load_row_manifest(filename):
+    try:
+        with open(filename) as fp:
+            return json.load(fp)['rows']
+    except FileNotFoundError:
+        return {}
+
+
+def save_row_manifest(filename, entries):
+    # write to a temporary file first so an interrupted run can't leave a
+    # truncated manifest behind
+    tmp = filename + '.tmp'
+    with open(tmp, 'w') as fp:
+        json.dump({'rows': entries}, fp, indent=1)
+    os.replace(tmp, filename)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Render a Jinja template with the rows of a CSV file.')
+    parser.add_argument('csvfile', nargs='?')
+    parser.add_argument('templatefile', nargs='?')
+    parser.add_argument('--batch', metavar='MANIFEST', default=None,
+                        help='render every csv, template, output row of the MANIFEST CSV')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of worker processes for --batch (default: one per CPU)')
+    parser.add_argument('--serve', action='store_true',
+                        help='run a render server that keeps models and templates warm')
+    parser.add_argument('--socket', default=None,
+                        help='UNIX socket of the render server (default: {})'.format(csv_client.default_socket_path()))
+    parser.add_argument('--no-server', action='store_true',
+                        help='always render in-process, even if a render server is running')
+    parser.add_argument('--profile', action='store_true',
+                        help='render in-process and print per-phase timings as JSON to stderr')
+    parser.add_argument('--profile-output', metavar='FILE', default=None,
+                        help='write the --profile JSON to FILE instead of stderr')
+    args = parser.parse_args(argv)
+    if args.profile_output:
+        args.profile = True
+    if not (args.serve or args.batch) and (args.csvfile is None or args.templatefile is None):
+        parser.error('csvfile and templatefile are required unless --serve or --batch is given')
+    return args
+
+
+def run_batch(manifest, workers=None):
+    import csv_batch
+    jobs = csv_batch.read_manifest(manifest)
+    done = []
+    def report(result):
+        done.append(result)
+        status = 'ok' if result.error is None else 'FAILED'
+        print('[{}/{}] {} {:.3f}s {}'.format(len(done), len(jobs), status, result.seconds, result.job.output),
+              file=sys.stderr)
+        if result.error is not None:
+            print('    {}'.format(result.error), file=sys.stderr)
+    start = time.perf_counter()
+    results = csv_batch.run_batch(jobs, workers=workers, progress=report)
+    failed = sum(result.error is not None for result in results)
+    print('{} jobs, {} failed in {:.3f}s'.format(len(results), failed, time.perf_counter() - start),
+          file=sys.stderr)
+    return failed
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.batch:
+        if run_batch(args.batch, args.workers):
+            sys.exit(1)
+        return
+    if args.serve:
+        import csv_server
+        csv_server.serve(args.socket)
+        return
+    if not args.no_server and not args.profile:
+        sys.stdout.flush()
+        try:
+            if csv_client.render_remote(args.csvfile, args.templatefile, sys.stdout.buffer, socket_path=args.socket):
+                sys.stdout.flush()
+                return
+        except csv_client.RenderServerError as e:
+            sys.exit('jinja_csv: {}'.format(e))
+    stats = RenderStats() if args.profile else None
+    output = render_template_from_csv(args.csvfile, args.templatefile, stats=stats)
     print(output, end='')
+    if args.profile and args.profile_output:
+        with open(args.profile_output, 'w') as fp:
+            fp.write(stats.to_json())
+    elif args.profile:
+        print(stats.to_json(), file=sys.stderr)
     #render_template_per_row(csvfile, templatefile, lambda name:os.path.join(output_path, '_'.join(name.lower().split()) + '.out'))
 
 
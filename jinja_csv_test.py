@@ -0,0 +1,121 @@
+import os
+import tempfile
+import unittest
+
+from jinja_csv import render_template_per_row
+
+
+class TestRenderTemplatePerRow(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dir = self.tmpdir.name
+        self.csvfile = self.path('data.csv')
+        self.manifest = self.path('manifest.json')
+        self.write('data.csv', 'Name,Score\nBob,1\nJoe,2\nAmy,3\n')
+        self.write('row.template', "{{ row.Name }}={{ row.Score }}{{ suffix }} {% include 'footer.template' %}")
+        self.write('footer.template', 'bye')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def write(self, name, text):
+        with open(self.path(name), 'w') as f:
+            f.write(text)
+
+    def read(self, name):
+        with open(self.path(name)) as f:
+            return f.read()
+
+    def output(self, key):
+        return self.path(key + '.out')
+
+    def render(self, **kwargs):
+        render_template_per_row(self.csvfile, 'row.template', self.output, template_path=self.dir,
+                                manifest=self.manifest, **kwargs)
+
+    def mark_outputs(self):
+        # outputs that get rewritten lose the marker
+        for key in ['Bob', 'Joe', 'Amy']:
+            if os.path.exists(self.output(key)):
+                self.write(key + '.out', 'marker')
+
+    def rewritten(self):
+        return sorted(key for key in ['Bob', 'Joe', 'Amy'] if self.read(key + '.out') != 'marker')
+
+    def test_without_manifest(self):
+        render_template_per_row(self.csvfile, 'row.template', self.output, template_path=self.dir)
+        self.assertEqual(self.read('Joe.out'), 'Joe=2 bye')
+        self.assertFalse(os.path.exists(self.manifest))
+
+    def test_unchanged(self):
+        self.render()
+        self.assertEqual(self.read('Bob.out'), 'Bob=1 bye')
+        self.mark_outputs()
+        self.render()
+        self.assertEqual(self.rewritten(), [])
+
+    def test_changed_row(self):
+        self.render()
+        self.mark_outputs()
+        self.write('data.csv', 'Name,Score\nBob,1\nJoe,5\nAmy,3\n')
+        self.render()
+        self.assertEqual(self.rewritten(), ['Joe'])
+        self.assertEqual(self.read('Joe.out'), 'Joe=5 bye')
+
+    def test_changed_include(self):
+        self.render()
+        self.mark_outputs()
+        self.write('footer.template', 'later')
+        self.render()
+        self.assertEqual(self.rewritten(), ['Amy', 'Bob', 'Joe'])
+        self.assertEqual(self.read('Amy.out'), 'Amy=3 later')
+
+    def test_changed_kwargs(self):
+        self.render(suffix='!')
+        self.mark_outputs()
+        self.render(suffix='?')
+        self.assertEqual(self.rewritten(), ['Amy', 'Bob', 'Joe'])
+
+    def test_missing_output(self):
+        self.render()
+        self.mark_outputs()
+        os.remove(self.output('Amy'))
+        self.render()
+        self.assertEqual(self.rewritten(), ['Amy'])
+
+    def test_removed_row(self):
+        self.render()
+        self.write('data.csv', 'Name,Score\nBob,1\nAmy,3\n')
+        self.render()
+        self.assertFalse(os.path.exists(self.output('Joe')))
+        self.assertTrue(os.path.exists(self.output('Bob')))
+
+    def test_duplicate_rowkey(self):
+        self.write('data.csv', 'Name,Score\nBob,1\nJoe,2\nBob,3\n')
+        with self.assertRaises(ValueError) as cm:
+            self.render()
+        self.assertIn('Bob', str(cm.exception))
+        self.assertFalse(os.path.exists(self.output('Joe')))
+
+    def test_duplicate_output(self):
+        self.write('data.csv', 'Name,Score\nBob X,1\nJoe,2\nbob x,3\n')
+        with self.assertRaises(ValueError) as cm:
+            render_template_per_row(self.csvfile, 'row.template', lambda key: self.output(key.lower()),
+                                    template_path=self.dir, manifest=self.manifest)
+        self.assertIn('bob x.out', str(cm.exception))
+        self.assertFalse(os.path.exists(self.output('joe')))
+
+    def test_moved_output(self):
+        self.render()
+        render_template_per_row(self.csvfile, 'row.template', lambda key: self.output(key.lower()),
+                                template_path=self.dir, manifest=self.manifest)
+        self.assertEqual(self.read('joe.out'), 'Joe=2 bye')
+        self.assertFalse(os.path.exists(self.output('Joe')))
+
+
+if __name__ == '__main__':
+    unittest.main()